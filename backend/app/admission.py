@@ -0,0 +1,228 @@
+"""
+Admission control for the expensive routes.
+
+Creating or re-planning a goal can wait seconds on the LLM, and logging in
+or registering runs bcrypt. Left alone, a burst of either fills the worker
+and every other route slows down with it. Each of these routes therefore
+goes through two checks, as a dependency:
+
+- a token bucket per user that answers 429 once a caller exceeds its
+  rate. Logins are limited per submitted username (optionally together
+  with the client address) so guessing one account's password from many
+  addresses is still slowed down, registrations per client address. The
+  address is read from X-Forwarded-For only when the request comes from
+  one of TRUSTED_PROXIES, so clients cannot pick their own bucket.
+- a concurrency limit per route with a bounded wait queue. Requests that
+  find the queue full, or wait longer than the route's timeout, get a 503.
+
+Both answers carry Retry-After. Cheap routes are not limited at all.
+"""
+import os
+import math
+import ipaddress
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+from app.auth import get_current_user
+from app.cache import LRUCache
+from app.models import User
+from app import plan_jobs
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+
+GOAL_PLAN_CONCURRENCY = int(os.getenv("GOAL_PLAN_CONCURRENCY", "8"))
+GOAL_PLAN_MAX_WAITING = int(os.getenv("GOAL_PLAN_MAX_WAITING", "32"))
+GOAL_PLAN_WAIT_SECONDS = float(os.getenv("GOAL_PLAN_WAIT_SECONDS", "10"))
+# Goal creations and updates per user and minute, and how many may come at once
+GOAL_PLAN_RATE_PER_MINUTE = float(os.getenv("GOAL_PLAN_RATE_PER_MINUTE", "10"))
+GOAL_PLAN_BURST = int(os.getenv("GOAL_PLAN_BURST", "5"))
+
+AUTH_CONCURRENCY = int(os.getenv("AUTH_CONCURRENCY", "16"))
+AUTH_MAX_WAITING = int(os.getenv("AUTH_MAX_WAITING", "64"))
+AUTH_WAIT_SECONDS = float(os.getenv("AUTH_WAIT_SECONDS", "5"))
+AUTH_RATE_PER_MINUTE = float(os.getenv("AUTH_RATE_PER_MINUTE", "20"))
+AUTH_BURST = int(os.getenv("AUTH_BURST", "10"))
+# Also split login buckets by client address, so one address cannot lock a user out
+AUTH_RATE_BY_ADDRESS = os.getenv("AUTH_RATE_BY_ADDRESS", "false").lower() == "true"
+# Comma-separated addresses or networks of the proxies allowed to set X-Forwarded-For
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in os.getenv("TRUSTED_PROXIES", "").split(",")
+    if entry.strip()
+]
+
+RATE_LIMIT_KEYS = int(os.getenv("RATE_LIMIT_KEYS", "100000"))
+BUSY_RETRY_AFTER_SECONDS = 1
+
+metrics: Dict = {}
+
+
+def _count(route: str, name: str, amount: int = 1):
+    key = f"{route}_{name}"
+    metrics[key] = metrics.get(key, 0) + amount
+
+
+class ConcurrencyLimiter:
+    """
+    Lets `limit` requests of a route run at once and up to `max_waiting`
+    more wait for a slot, each for at most `wait_seconds`.
+    """
+
+    def __init__(self, route: str, limit: int, max_waiting: int, wait_seconds: float):
+        self.route = route
+        self.max_waiting = max_waiting
+        self.wait_seconds = wait_seconds
+        self._slots = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.in_flight = 0
+        for name in ("admitted", "queue_full", "wait_timeouts", "in_flight", "waiting"):
+            metrics.setdefault(f"{route}_{name}", 0)
+
+    def _busy(self, reason: str) -> HTTPException:
+        _count(self.route, reason)
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": str(BUSY_RETRY_AFTER_SECONDS)},
+        )
+
+    async def acquire(self):
+        if self._slots.locked():
+            if self.waiting >= self.max_waiting:
+                raise self._busy("queue_full")
+            self.waiting += 1
+            metrics[f"{self.route}_waiting"] = self.waiting
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.wait_seconds)
+            except asyncio.TimeoutError:
+                raise self._busy("wait_timeouts")
+            finally:
+                self.waiting -= 1
+                metrics[f"{self.route}_waiting"] = self.waiting
+        else:
+            await self._slots.acquire()
+        self.in_flight += 1
+        metrics[f"{self.route}_in_flight"] = self.in_flight
+        _count(self.route, "admitted")
+
+    def release(self):
+        self.in_flight -= 1
+        metrics[f"{self.route}_in_flight"] = self.in_flight
+        self._slots.release()
+
+
+class RateLimiter:
+    """
+    Token buckets of `burst` tokens refilled at `per_minute` per key. Idle
+    buckets are full, so only the most recently used are kept.
+    """
+
+    def __init__(self, route: str, per_minute: float, burst: int, keys: int = RATE_LIMIT_KEYS):
+        self.route = route
+        self.rate = per_minute / 60
+        self.burst = burst
+        self._buckets = LRUCache(keys, burst / self.rate if self.rate else float("inf"))
+        metrics.setdefault(f"{route}_rate_limited", 0)
+
+    def take(self, key: str):
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key) or (self.burst, now)
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self._buckets.set(key, (tokens, now))
+            _count(self.route, "rate_limited")
+            retry_after = math.ceil((1 - tokens) / self.rate) if self.rate else 60
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please slow down",
+                headers={"Retry-After": str(retry_after)},
+            )
+        self._buckets.set(key, (tokens - 1, now))
+
+
+goal_plan_slots = ConcurrencyLimiter("goal_plan", GOAL_PLAN_CONCURRENCY, GOAL_PLAN_MAX_WAITING, GOAL_PLAN_WAIT_SECONDS)
+goal_plan_rate = RateLimiter("goal_plan", GOAL_PLAN_RATE_PER_MINUTE, GOAL_PLAN_BURST)
+auth_slots = ConcurrencyLimiter("auth", AUTH_CONCURRENCY, AUTH_MAX_WAITING, AUTH_WAIT_SECONDS)
+auth_rate = RateLimiter("auth", AUTH_RATE_PER_MINUTE, AUTH_BURST)
+
+
+@asynccontextmanager
+async def _admitted(slots: ConcurrencyLimiter, rate: RateLimiter, key: str):
+    if not ADMISSION_ENABLED:
+        yield
+        return
+    rate.take(key)
+    await slots.acquire()
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+async def limit_goal_plans(current_user: User = Depends(get_current_user)):
+    """
+    Dependency of the routes that generate a habit plan while the request
+    waits.
+    """
+    async with _admitted(goal_plan_slots, goal_plan_rate, str(current_user.id)):
+        yield
+
+
+async def limit_goal_creation(async_plan: bool = False, current_user: User = Depends(get_current_user)):
+    """
+    Dependency of goal creation. Plans made by the job queue are bounded by
+    its workers, so those only count towards the rate.
+    """
+    if async_plan and plan_jobs.job_queue is not None:
+        if ADMISSION_ENABLED:
+            goal_plan_rate.take(str(current_user.id))
+        yield
+        return
+    async with _admitted(goal_plan_slots, goal_plan_rate, str(current_user.id)):
+        yield
+
+
+def _trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_address(request: Request) -> str:
+    """
+    The address of the client, following X-Forwarded-For from the right
+    through the trusted proxies up to the first hop that is not one.
+    """
+    address = request.client.host if request.client else "unknown"
+    if not _trusted(address):
+        return address
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        address = hop
+        if not _trusted(hop):
+            break
+    return address
+
+
+async def limit_auth(request: Request):
+    """
+    Dependency of the routes that hash a new password.
+    """
+    async with _admitted(auth_slots, auth_rate, f"address:{client_address(request)}"):
+        yield
+
+
+async def limit_login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    """
+    Dependency of login, limited per submitted username.
+    """
+    key = f"user:{form_data.username.strip().lower()}"
+    if AUTH_RATE_BY_ADDRESS:
+        key = f"{key}|{client_address(request)}"
+    async with _admitted(auth_slots, auth_rate, key):
+        yield
@@ -1,15 +1,54 @@
 import os
-import openai
-from typing import List, Dict
+import time
+import asyncio
+import logging
+import threading
+from typing import List, Dict, Callable, Awaitable
 import json
+from app.metrics import llm_duration
 
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
 
-def generate_habit_plan(goal_description: str) -> List[Dict]:
+AI_BACKEND = os.getenv("AI_BACKEND", "openai")
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+AI_CLIENT_WARMUP = os.getenv("AI_CLIENT_WARMUP", "true").lower() == "true"
+
+PlanBackend = Callable[[str], Awaitable[List[Dict]]]
+
+# The openai package takes longer to import than the rest of the app, so
+# it is only loaded when the first plan is generated
+_client = None
+# A request can ask for the client while the warmup thread is creating it
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import openai
+
+                _client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=OPENAI_TIMEOUT_SECONDS)
+    return _client
+
+async def warm_up():
     """
-    Analyzes a user's goal and returns a structured list of suggested habits.
+    Creates the client in a thread, so the first goal created does not pay
+    for importing openai.
     """
-    prompt = f"""
+    try:
+        await asyncio.to_thread(get_client)
+    except Exception:
+        logger.exception("Loading the OpenAI client failed")
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+    _client = None
+
+def build_prompt(goal_description: str) -> str:
+    return f"""
 You are an expert in behavior design and habit formation.
 Your task is to take the provided goal and break it down into a series of small, actionable habits.
 
@@ -32,27 +71,57 @@ Goal: "{goal_description}"
 JSON output:
 """
 
+def parse_plan(content: str) -> List[Dict]:
+    content = content.strip()
+
+    # Remove Markdown code block formatting if present
+    if content.startswith("```"):
+        content = content.strip("`")
+        # Remove leading json tag if present
+        if content.lower().startswith("json"):
+            content = content[4:].strip()
+
+    return json.loads(content)
+
+async def openai_plan_backend(goal_description: str) -> List[Dict]:
+    response = await get_client().chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that helps users break down their goals into actionable habits."},
+            {"role": "user", "content": build_prompt(goal_description)}
+        ],
+        temperature=0.7,
+    )
+    return parse_plan(response.choices[0].message.content)
+
+async def stub_plan_backend(goal_description: str) -> List[Dict]:
+    """
+    Deterministic offline plan, used for local development and tests.
+    """
+    return [
+        {"description": f"Spend 15 minutes on: {goal_description}", "frequency": "daily"},
+        {"description": f"Write down one thing you did today towards: {goal_description}", "frequency": "daily"},
+        {"description": f"Review your progress on: {goal_description}", "frequency": "weekly"},
+    ]
+
+plan_backends: Dict[str, PlanBackend] = {
+    "openai": openai_plan_backend,
+    "stub": stub_plan_backend,
+}
+
+def register_plan_backend(name: str, backend: PlanBackend):
+    plan_backends[name] = backend
+
+async def generate_habit_plan(goal_description: str) -> List[Dict]:
+    """
+    Analyzes a user's goal and returns a structured list of suggested habits.
+    """
+    started = time.perf_counter()
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that helps users break down their goals into actionable habits."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-        )
-
-        content = response.choices[0].message.content.strip()
-
-        # Remove Markdown code block formatting if present
-        if content.startswith("```"):
-            content = content.strip("`")
-            # Remove leading json tag if present
-            if content.lower().startswith("json"):
-                content = content[4:].strip()
-
-        return json.loads(content)
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return []
\ No newline at end of file
+        habits = await plan_backends[AI_BACKEND](goal_description)
+        llm_duration.observe(time.perf_counter() - started, AI_BACKEND, "ok")
+        return habits
+    except Exception:
+        llm_duration.observe(time.perf_counter() - started, AI_BACKEND, "error")
+        logger.exception("Habit plan generation failed")
+        return []
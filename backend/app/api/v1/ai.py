@@ -1,6 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
 from app import models, auth
-from app.database import database as db
 from app.ai_service import generate_habit_plan
 import json
 
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1 import auth, users, goals, todos, send_sms, ai
+from app.api.v1 import auth, users, goals, todos, send_sms, ai, dashboard, events
 
 router = APIRouter()
 router.include_router(auth.router, prefix="/auth", tags=["auth"])
@@ -7,4 +7,6 @@ router.include_router(users.router, prefix="/users", tags=["users"])
 router.include_router(goals.router, prefix="/goals", tags=["goals"])
 router.include_router(todos.router, prefix="/todos", tags=["todos"])
 router.include_router(send_sms.router, prefix="/sms", tags=["sms"])
-router.include_router(ai.router, prefix="/ai", tags=["ai"])
\ No newline at end of file
+router.include_router(ai.router, prefix="/ai", tags=["ai"])
+router.include_router(dashboard.router, prefix="/dashboard", tags=["dashboard"])
+router.include_router(events.router, prefix="/events", tags=["events"])
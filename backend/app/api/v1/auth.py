@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from app.models import UserCreate, User
-from app.auth import get_password_hash
+from app.auth import invalidate_user
+from app.password_service import hash_password, verify_password
+from app.admission import limit_auth, limit_login
 from app.database import get_database
 from pymongo.database import Database
 from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
+@router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED, dependencies=[Depends(limit_auth)])
 async def register_user(user: UserCreate, db: Database = Depends(get_database)):
     try:
         user_dict = user.dict()
@@ -18,7 +23,7 @@ async def register_user(user: UserCreate, db: Database = Depends(get_database)):
                 detail="Email already registered",
             )
 
-        hashed_password = get_password_hash(user_dict["password"])
+        hashed_password = await hash_password(user_dict["password"])
         user_doc = {
             "email": user_dict["email"],
             "hashed_password": hashed_password,
@@ -26,6 +31,7 @@ async def register_user(user: UserCreate, db: Database = Depends(get_database)):
         }
         
         result = await db.users.insert_one(user_doc)
+        invalidate_user(result.inserted_id, user_doc["email"])
         created_user = await db.users.find_one({"_id": result.inserted_id})
         
         # Convert ObjectId to string for proper serialization
@@ -35,34 +41,43 @@ async def register_user(user: UserCreate, db: Database = Depends(get_database)):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Registration error: {e}")
+        logger.exception("Registration failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Internal server error during registration: {str(e)}"
         )
 
 from fastapi.security import OAuth2PasswordRequestForm
-from app.auth import verify_password, create_access_token
+from app.auth import create_access_token
 from app.models import Token
 from datetime import timedelta
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-@router.post("/login", response_model=Token)
+@router.post("/login", response_model=Token, dependencies=[Depends(limit_login)])
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), 
     db: Database = Depends(get_database)
 ):
     user = await db.users.find_one({"email": form_data.username})
-    if not user or not verify_password(form_data.password, user["hashed_password"]):
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await verify_password(form_data.password, user["hashed_password"])
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # The stored hash was made with a different bcrypt cost, upgrade it
+    if new_hash:
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"hashed_password": new_hash}})
+        invalidate_user(user["_id"], user["email"])
+
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user["email"]}, expires_delta=access_token_expires
+        data={"sub": user["email"], "uid": str(user["_id"])}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends
+from app.models import DashboardSummary, User
+from app.database import get_stats_database
+from app.auth import get_current_user
+from app.dashboard import get_summary
+from app.serialization import shape, LeanJSONResponse
+
+router = APIRouter()
+
+@router.get("/summary", response_model=DashboardSummary)
+async def get_dashboard_summary(
+    db=Depends(get_stats_database),
+    current_user: User = Depends(get_current_user)
+):
+    return LeanJSONResponse(shape(await get_summary(db, current_user.id), DashboardSummary))
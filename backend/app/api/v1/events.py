@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from app.models import User
+from app.auth import get_stream_user
+from app import events
+
+router = APIRouter()
+
+@router.get("")
+async def stream_events(current_user: User = Depends(get_stream_user)):
+    subscription = events.bus.subscribe(current_user.id)
+    if subscription is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many live connections, please retry",
+            headers={"Retry-After": str(events.EVENTS_RETRY_MS // 1000)},
+        )
+    return StreamingResponse(
+        events.stream(subscription),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
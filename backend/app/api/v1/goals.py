@@ -1,117 +1,134 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
-from app.models import GoalCreate, Goal, GoalWithHabits, Habit, GoalUpdate, Todo, GoalWithProgress, GoalStatusUpdate
-from app.database import database as db
-from app.ai_service import generate_habit_plan
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from typing import List, Optional
+from app.models import GoalCreate, Goal, GoalWithHabits, Habit, GoalUpdate, Todo, GoalWithProgress, GoalStatusUpdate, ProgressDay
+from app.database import get_database, get_stats_database, reads_primary
+from app.plan_cache import get_habit_plan
+from app.goal_service import create_goal_with_plan, apply_habit_diff
+from app import plan_jobs, response_cache, events
+from app.response_cache import cached_response
+from app.serialization import shape
+from app.counters import ZERO_COUNTS, goal_days
+from app.purge import NOT_DELETED, soft_delete_goal
+from app.progress import fetch_goals_with_progress, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from app.auth import get_current_user
+from app.admission import limit_goal_creation, limit_goal_plans
 from app.models import User
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from bson import ObjectId
 
 router = APIRouter()
 
-@router.post("", response_model=GoalWithHabits)
+@router.post("", response_model=GoalWithHabits, dependencies=[Depends(limit_goal_creation)])
 async def create_goal(
     goal: GoalCreate,
+    async_plan: bool = False,
+    db=Depends(get_database),
     current_user: User = Depends(get_current_user)
 ):
-    # 1. Get habit plan from AI service
-    habits_data = generate_habit_plan(goal.description)
-    if not habits_data:
-        raise HTTPException(status_code=500, detail="Failed to generate habit plan")
-
-    # 2. Save the goal to the database
     goal_doc = {
         "description": goal.description,
         "user_id": current_user.id,
         "completion_date": goal.completion_date,
         "category": goal.category.value if goal.category else "Other",
+        **ZERO_COUNTS,
     }
-    result = await db.goals.insert_one(goal_doc)
-    goal_id = result.inserted_id
-
-    # 3. Save the habits to the database
-    habits_to_create = []
-    for habit_data in habits_data:
-        habit_doc = {
-            "description": habit_data["description"],
-            "frequency": habit_data["frequency"],
-            "goal_id": goal_id,
-        }
-        habits_to_create.append(habit_doc)
-    
-    if habits_to_create:
-        habit_results = await db.habits.insert_many(habits_to_create)
-        inserted_habit_ids = habit_results.inserted_ids
-        
-        # 4. Create todos for daily habits
-        today = datetime.now().date()
-        start_of_day = datetime(today.year, today.month, today.day)
-        
-        newly_created_habits = await db.habits.find({"_id": {"$in": inserted_habit_ids}}).to_list(length=100)
-
-        for habit in newly_created_habits:
-            if habit["frequency"] == "daily":
-                new_todo = Todo(
-                    description=habit["description"],
-                    completed=False,
-                    due_date=start_of_day,
-                    user_id=current_user.id,
-                    habit_id=habit["_id"]
-                )
-                await db.todos.insert_one(new_todo.dict(by_alias=True))
-
-    # 5. Return the created goal with habits
-    created_goal = await db.goals.find_one({"_id": goal_id})
-    habits_cursor = db.habits.find({"goal_id": goal_id})
-    habits = await habits_cursor.to_list(length=100)
-    
-    return GoalWithHabits(**created_goal, habits=habits)
+
+    # Job mode: store the goal right away and let a plan worker add the habits
+    if async_plan and plan_jobs.job_queue is not None:
+        job_id = ObjectId()
+        goal_doc["plan_status"] = plan_jobs.PENDING
+        goal_doc["plan_job_id"] = job_id
+        result = await db.goals.insert_one(goal_doc)
+        await plan_jobs.job_queue.submit(result.inserted_id, current_user.id, goal.description, goal_doc["category"], job_id=job_id)
+        await response_cache.bump(current_user.id)
+        events.emit(current_user.id, events.goal_event(goal_doc))
+        return GoalWithHabits(**goal_doc, habits=[])
+
+    # 1. Get habit plan from AI service
+    habits_data = await get_habit_plan(db, goal.description, goal_doc["category"])
+    if not habits_data:
+        raise HTTPException(status_code=500, detail="Failed to generate habit plan")
+
+    # 2. Save the goal, its habits and today's todos in one transaction
+    habits = await create_goal_with_plan(db, goal_doc, habits_data)
+    await response_cache.bump(current_user.id)
+    events.emit(current_user.id, events.goal_event(goal_doc))
+    events.emit(current_user.id, {"type": "changed", "scope": "todos"})
+
+    # 3. Respond from the documents that were written
+    return GoalWithHabits(**goal_doc, habits=habits)
 
 @router.get("", response_model=List[GoalWithProgress])
-async def get_goals(current_user: User = Depends(get_current_user)):
-    goals_cursor = db.goals.find({"user_id": current_user.id})
-    goals = await goals_cursor.to_list(length=100)
-    
-    goals_with_progress = []
-    for goal in goals:
-        habits_cursor = db.habits.find({"goal_id": goal["_id"]})
-        habits = await habits_cursor.to_list(length=100)
-        
-        total_todos = 0
-        completed_todos = 0
-        
-        habit_ids = [habit["_id"] for habit in habits]
-        
-        if habit_ids:
-            todos_cursor = db.todos.find({"habit_id": {"$in": habit_ids}})
-            all_todos = await todos_cursor.to_list(length=None)
-            
-            total_todos = len(all_todos)
-            completed_todos = len([todo for todo in all_todos if todo["completed"]])
-
-        progress = (completed_todos / total_todos) * 100 if total_todos > 0 else 0
-        
-        goals_with_progress.append(GoalWithProgress(**goal, habits=habits, progress=progress, status=goal.get("status", "in_progress")))
-        
-    return goals_with_progress
+async def get_goals(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db=Depends(get_stats_database),
+    current_user: User = Depends(get_current_user)
+):
+    after = None
+    if cursor:
+        try:
+            after = ObjectId(cursor)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    async def render(response: Response):
+        # Fetch one extra goal to know whether another page follows
+        goals = await fetch_goals_with_progress(db, current_user.id, after=after, limit=limit + 1)
+        if len(goals) > limit:
+            goals = goals[:limit]
+            response.headers["X-Next-Cursor"] = str(goals[-1]["_id"])
+        return [shape(goal, GoalWithProgress) for goal in goals]
+
+    return await cached_response(request, current_user.id, "goals", render, cacheable=reads_primary(db))
 
 @router.get("/stats", response_model=dict)
-async def get_goal_stats(current_user: User = Depends(get_current_user)):
-    pipeline = [
-        {"$match": {"user_id": current_user.id}},
-        {"$group": {"_id": {"$ifNull": ["$category", "Other"]}, "count": {"$sum": 1}}}
-    ]
-    stats_cursor = db.goals.aggregate(pipeline)
-    stats = await stats_cursor.to_list(length=None)
-    
-    # Convert list of dicts to a single dict
-    stats_dict = {item["_id"]: item["count"] for item in stats}
-    return stats_dict
+async def get_goal_stats(
+    request: Request,
+    db=Depends(get_stats_database),
+    current_user: User = Depends(get_current_user)
+):
+    async def render(response: Response):
+        pipeline = [
+            {"$match": {"user_id": current_user.id, **NOT_DELETED}},
+            {"$group": {"_id": {"$ifNull": ["$category", "Other"]}, "count": {"$sum": 1}}}
+        ]
+        stats_cursor = db.goals.aggregate(pipeline)
+        stats = await stats_cursor.to_list(length=None)
+
+        # Convert list of dicts to a single dict
+        return {item["_id"]: item["count"] for item in stats}
+
+    return await cached_response(request, current_user.id, "goals/stats", render, cacheable=reads_primary(db))
+
+@router.get("/jobs/{job_id}", response_model=dict)
+async def get_plan_job(
+    job_id: str,
+    db=Depends(get_database),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        obj_job_id = ObjectId(job_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid job ID")
+
+    job = await db.plan_jobs.find_one({"_id": obj_job_id, "user_id": current_user.id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        "id": str(job["_id"]),
+        "goal_id": str(job["goal_id"]),
+        "status": job["status"],
+        "error": job.get("error"),
+    }
 
 @router.get("/{goal_id}", response_model=GoalWithHabits)
 async def get_goal(
     goal_id: str,
+    request: Request,
+    db=Depends(get_database),
     current_user: User = Depends(get_current_user)
 ):
     try:
@@ -119,19 +136,43 @@ async def get_goal(
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid goal ID")
 
-    goal = await db.goals.find_one({"_id": obj_goal_id, "user_id": current_user.id})
-    if not goal:
-        raise HTTPException(status_code=404, detail="Goal not found")
+    async def render(response: Response):
+        goal = await db.goals.find_one({"_id": obj_goal_id, "user_id": current_user.id, **NOT_DELETED})
+        if not goal:
+            raise HTTPException(status_code=404, detail="Goal not found")
 
-    habits_cursor = db.habits.find({"goal_id": obj_goal_id})
-    habits = await habits_cursor.to_list(length=100)
-    
-    return GoalWithHabits(**goal, habits=habits)
+        habits_cursor = db.habits.find({"goal_id": obj_goal_id})
+        habits = await habits_cursor.to_list(length=100)
+        return shape({**goal, "habits": habits}, GoalWithHabits)
+
+    return await cached_response(request, current_user.id, f"goals/{obj_goal_id}", render)
 
-@router.put("/{goal_id}", response_model=GoalWithHabits)
+@router.get("/{goal_id}/days", response_model=List[ProgressDay])
+async def get_goal_days(
+    goal_id: str,
+    request: Request,
+    days: int = Query(30, ge=1, le=366),
+    db=Depends(get_stats_database),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        obj_goal_id = ObjectId(goal_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid goal ID")
+
+    async def render(response: Response):
+        goal = await db.goals.find_one({"_id": obj_goal_id, "user_id": current_user.id, **NOT_DELETED}, {"_id": 1})
+        if not goal:
+            raise HTTPException(status_code=404, detail="Goal not found")
+        return await goal_days(db, obj_goal_id, date.today() - timedelta(days=days - 1))
+
+    return await cached_response(request, current_user.id, f"goals/{obj_goal_id}/days", render, cacheable=reads_primary(db))
+
+@router.put("/{goal_id}", response_model=GoalWithHabits, dependencies=[Depends(limit_goal_plans)])
 async def update_goal(
     goal_id: str,
     goal_update: GoalUpdate,
+    db=Depends(get_database),
     current_user: User = Depends(get_current_user)
 ):
     try:
@@ -139,7 +180,7 @@ async def update_goal(
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid goal ID")
 
-    existing_goal = await db.goals.find_one({"_id": obj_goal_id, "user_id": current_user.id})
+    existing_goal = await db.goals.find_one({"_id": obj_goal_id, "user_id": current_user.id, **NOT_DELETED})
     if not existing_goal:
         raise HTTPException(status_code=404, detail="Goal not found")
 
@@ -149,53 +190,39 @@ async def update_goal(
     if goal_update.category is not None:
         update_fields["category"] = goal_update.category.value
 
+    # Explicit habits win; otherwise a new description gets a new plan
+    desired = None
+    if goal_update.habits is not None:
+        desired = [habit.dict() for habit in goal_update.habits]
+    elif goal_update.description and goal_update.description != existing_goal["description"]:
+        category = update_fields.get("category", existing_goal.get("category"))
+        desired = await get_habit_plan(db, goal_update.description, category)
+        if not desired:
+            raise HTTPException(status_code=500, detail="Failed to generate new habit plan")
+
     if update_fields:
         await db.goals.update_one(
             {"_id": obj_goal_id},
             {"$set": update_fields}
         )
 
-    if goal_update.description:
-        await db.habits.delete_many({"goal_id": obj_goal_id})
-        habits_data = generate_habit_plan(goal_update.description)
-        if not habits_data:
-            raise HTTPException(status_code=500, detail="Failed to generate new habit plan")
-        habits_to_create = []
-        for habit_data in habits_data:
-            habit_doc = {
-                "description": habit_data["description"],
-                "frequency": habit_data["frequency"],
-                "goal_id": obj_goal_id,
-            }
-            habits_to_create.append(habit_doc)
-        if habits_to_create:
-            await db.habits.insert_many(habits_to_create)
-
-    if goal_update.habits is not None:
-        await db.habits.delete_many({"goal_id": obj_goal_id})
-        
-        habits_to_create = []
-        for habit_data in goal_update.habits:
-            habit_doc = {
-                "description": habit_data.description,
-                "frequency": habit_data.frequency,
-                "goal_id": obj_goal_id,
-            }
-            habits_to_create.append(habit_doc)
-        
-        if habits_to_create:
-            await db.habits.insert_many(habits_to_create)
+    existing_habits = await db.habits.find({"goal_id": obj_goal_id}, {"streak": 0}).to_list(length=None)
+    if desired is not None:
+        habits = await apply_habit_diff(db, obj_goal_id, existing_habits, desired)
+    else:
+        habits = existing_habits
 
-    updated_goal = await db.goals.find_one({"_id": obj_goal_id})
-    habits_cursor = db.habits.find({"goal_id": obj_goal_id})
-    habits = await habits_cursor.to_list(length=100)
-    
-    return GoalWithHabits(**updated_goal, habits=habits)
+    await response_cache.bump(current_user.id)
+    events.emit(current_user.id, events.goal_event({**existing_goal, **update_fields}))
+    if desired is not None:
+        events.emit(current_user.id, {"type": "changed", "scope": "todos"})
+    return GoalWithHabits(**{**existing_goal, **update_fields}, habits=habits)
 
 @router.patch("/{goal_id}/status", response_model=Goal)
 async def update_goal_status(
     goal_id: str,
     status_update: GoalStatusUpdate,
+    db=Depends(get_database),
     current_user: User = Depends(get_current_user)
 ):
     try:
@@ -203,7 +230,7 @@ async def update_goal_status(
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid goal ID")
 
-    existing_goal = await db.goals.find_one({"_id": obj_goal_id, "user_id": current_user.id})
+    existing_goal = await db.goals.find_one({"_id": obj_goal_id, "user_id": current_user.id, **NOT_DELETED})
     if not existing_goal:
         raise HTTPException(status_code=404, detail="Goal not found")
 
@@ -211,27 +238,27 @@ async def update_goal_status(
         {"_id": obj_goal_id},
         {"$set": {"status": status_update.status}}
     )
+    await response_cache.bump(current_user.id)
 
     updated_goal = await db.goals.find_one({"_id": obj_goal_id})
+    events.emit(current_user.id, events.goal_event(updated_goal))
     return updated_goal
 
 @router.delete("/{goal_id}", status_code=204)
 async def delete_goal(
     goal_id: str,
+    db=Depends(get_database),
     current_user: User = Depends(get_current_user)
 ):
-    # 1. Find the goal and check ownership
     try:
         obj_goal_id = ObjectId(goal_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid goal ID")
 
-    existing_goal = await db.goals.find_one({"_id": obj_goal_id, "user_id": current_user.id})
-    if not existing_goal:
+    # Mark the goal deleted; the purge worker removes its habits and todos
+    if not await soft_delete_goal(db, obj_goal_id, current_user.id):
         raise HTTPException(status_code=404, detail="Goal not found")
-
-    # 2. Delete the goal and its associated habits
-    await db.habits.delete_many({"goal_id": obj_goal_id})
-    await db.goals.delete_one({"_id": obj_goal_id})
+    await response_cache.bump(current_user.id)
+    events.emit(current_user.id, {"type": "goal_deleted", "id": goal_id})
 
     return
\ No newline at end of file
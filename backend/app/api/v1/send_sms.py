@@ -1,5 +1,8 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
+from app.models import User
+from app.auth import get_current_user
+from app import notifications
 
 router = APIRouter()
 
@@ -9,9 +12,21 @@ class SMSPayload(BaseModel):
     message: str
 
 
-@router.post("/send-sms/")
-async def send_sms(payload: SMSPayload):
+@router.post("/send-sms/", status_code=status.HTTP_202_ACCEPTED)
+async def send_sms(payload: SMSPayload, current_user: User = Depends(get_current_user)):
     if not payload.phone_number or not payload.message:
         raise HTTPException(status_code=400, detail="Phone number and message are required.")
-    print(f"Sending SMS to {payload.phone_number}: {payload.message}")
-    return {"message": "SMS sent successfully"}
\ No newline at end of file
+    message = {
+        "user_id": current_user.id,
+        "channel": "sms",
+        "to": payload.phone_number,
+        "body": payload.message,
+        "kind": "direct",
+    }
+    if notifications.dispatcher is None or not notifications.dispatcher.submit(message):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many messages queued, please retry",
+            headers={"Retry-After": "5"},
+        )
+    return {"message": "SMS queued"}
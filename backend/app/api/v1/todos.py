@@ -1,55 +1,83 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from typing import List, Optional
 from app.database import get_database
-from app.models import Todo, User, Habit, TodoUpdate
+from app.models import Todo, User, Habit, TodoUpdate, TodoBatch, TodoBatchResult, TodoChanges
 from app.auth import get_current_user
+from app.todo_service import (
+    build_todo, materialize_todos, start_of_day, now_ms, delete_tombstones, apply_todo_batch, todo_changes,
+)
+from app.counters import apply_todo_deltas
+from app.purge import NOT_DELETED
+from app import response_cache, events
+from app.response_cache import cached_response
+from app.serialization import shape, LeanJSONResponse
+from pymongo import ReturnDocument
 from datetime import datetime, date
 from bson import ObjectId
 
+BATCH_MAX_ITEMS = int(os.getenv("TODO_BATCH_MAX_ITEMS", "500"))
+SYNC_PAGE_SIZE = int(os.getenv("TODO_SYNC_PAGE_SIZE", "500"))
+
 router = APIRouter()
 
 @router.get("/", response_model=List[Todo])
 async def get_daily_todos(
+    request: Request,
     db=Depends(get_database),
     current_user: User = Depends(get_current_user),
 ):
-    today = date.today()
-    start_of_day = datetime(today.year, today.month, today.day)
-    end_of_day = datetime(today.year, today.month, today.day, 23, 59, 59)
-
-    # Fetch all goals for the current user
-    goals_cursor = db.goals.find({"user_id": current_user.id})
-    goals = await goals_cursor.to_list(length=None)
-    goal_ids = [goal["_id"] for goal in goals]
-
-    # Fetch all daily habits for those goals
-    habits_cursor = db.habits.find({
-        "goal_id": {"$in": goal_ids},
-        "frequency": "daily"
-    })
-    daily_habits = await habits_cursor.to_list(length=None)
-
-    todos = []
-    for habit in daily_habits:
-        existing_todo = await db.todos.find_one({
-            "habit_id": habit["_id"],
-            "due_date": {"$gte": start_of_day, "$lte": end_of_day}
+    due_date = start_of_day(date.today())
+
+    async def render(response: Response):
+        # Fetch all goals for the current user
+        goals_cursor = db.goals.find({"user_id": current_user.id, **NOT_DELETED}, {"_id": 1})
+        goals = await goals_cursor.to_list(length=None)
+        goal_ids = [goal["_id"] for goal in goals]
+
+        # Fetch all daily habits for those goals
+        habits_cursor = db.habits.find({
+            "goal_id": {"$in": goal_ids},
+            "frequency": "daily"
         })
+        daily_habits = await habits_cursor.to_list(length=None)
 
-        if existing_todo:
-            todos.append(Todo(**existing_todo))
-        else:
-            new_todo = Todo(
-                description=habit["description"],
-                completed=False,
-                due_date=start_of_day,
-                user_id=current_user.id,
-                habit_id=habit["_id"]
-            )
-            await db.todos.insert_one(new_todo.dict(by_alias=True))
-            todos.append(new_todo)
-    
-    return todos
+        # Read today's todos in one query and bulk insert the missing ones
+        new_todos = [build_todo(habit, current_user.id, due_date) for habit in daily_habits]
+        todos = await materialize_todos(db, new_todos, due_date)
+
+        # Creating todos changes goal progress
+        new_ids = {todo["_id"] for todo in new_todos}
+        if any(todo["_id"] in new_ids for todo in todos):
+            await response_cache.bump(current_user.id)
+            events.emit(current_user.id, {"type": "changed", "scope": "todos"})
+        return [shape(todo, Todo) for todo in todos]
+
+    return await cached_response(request, current_user.id, f"todos:{due_date.date().isoformat()}", render)
+
+@router.post("/batch", response_model=List[TodoBatchResult])
+async def batch_update_todos(
+    batch: TodoBatch,
+    db=Depends(get_database),
+    current_user: User = Depends(get_current_user),
+):
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    results = await apply_todo_batch(db, current_user.id, batch.items)
+    await response_cache.bump(current_user.id)
+    events.emit(current_user.id, {"type": "changed", "scope": "todos"})
+    return results
+
+@router.get("/changes", response_model=TodoChanges)
+async def get_todo_changes(
+    cursor: Optional[str] = None,
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=SYNC_PAGE_SIZE),
+    db=Depends(get_database),
+    current_user: User = Depends(get_current_user),
+):
+    changes = await todo_changes(db, current_user.id, cursor, limit)
+    changes["todos"] = [shape(todo, Todo) for todo in changes["todos"]]
+    return LeanJSONResponse(changes)
 
 @router.put("/{todo_id}", response_model=Todo)
 async def update_todo(
@@ -59,18 +87,25 @@ async def update_todo(
     current_user: User = Depends(get_current_user),
 ):
     todo_object_id = ObjectId(todo_id)
+    updated_at = now_ms()
     
-    updated_todo = await db.todos.find_one_and_update(
+    previous_todo = await db.todos.find_one_and_update(
         {"_id": todo_object_id, "user_id": current_user.id},
-        {"$set": {"completed": todo_update.completed}},
-        return_document=True
+        {"$set": {"completed": todo_update.completed, "updated_at": updated_at}},
+        return_document=ReturnDocument.BEFORE
     )
 
-    if updated_todo:
-        return Todo(**updated_todo)
-    else:
+    if not previous_todo:
         raise HTTPException(status_code=404, detail="Todo not found")
 
+    todo = {**previous_todo, "completed": todo_update.completed, "updated_at": updated_at}
+    if previous_todo["completed"] != todo_update.completed:
+        await apply_todo_deltas(db, [(previous_todo, 0, 1 if todo_update.completed else -1)])
+        await response_cache.bump(current_user.id)
+        events.emit(current_user.id, events.todo_event(todo))
+
+    return Todo(**todo)
+
 @router.delete("/{todo_id}", status_code=204)
 async def delete_todo(
     todo_id: str,
@@ -79,9 +114,14 @@ async def delete_todo(
 ):
     todo_object_id = ObjectId(todo_id)
     
-    delete_result = await db.todos.delete_one(
+    deleted_todo = await db.todos.find_one_and_delete(
         {"_id": todo_object_id, "user_id": current_user.id}
     )
 
-    if delete_result.deleted_count == 0:
+    if not deleted_todo:
         raise HTTPException(status_code=404, detail="Todo not found")
+
+    await delete_tombstones(db, [deleted_todo], now_ms())
+    await apply_todo_deltas(db, [(deleted_todo, -1, -1 if deleted_todo["completed"] else 0)])
+    await response_cache.bump(current_user.id)
+    events.emit(current_user.id, {"type": "todo_deleted", "id": todo_id})
@@ -1,11 +1,55 @@
-from fastapi import APIRouter, Depends
-from app.models import User
-from app.auth import get_current_user
+from typing import Literal
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+from app.models import User, ReminderSettings
+from app.auth import get_current_user, invalidate_user
 from app.database import get_database
+from app import response_cache, events
+from app.export_service import export_ndjson, export_csv, parse_ndjson, parse_csv, import_records
 from pymongo.database import Database
 
 router = APIRouter()
 
 @router.get("/me", response_model=User)
 async def read_users_me(current_user: User = Depends(get_current_user)):
-    return current_user
\ No newline at end of file
+    return current_user
+
+@router.put("/me/reminders", response_model=ReminderSettings)
+async def update_reminders(
+    settings: ReminderSettings,
+    db=Depends(get_database),
+    current_user: User = Depends(get_current_user)
+):
+    await db.users.update_one({"_id": current_user.id}, {"$set": {"reminders": settings.dict()}})
+    invalidate_user(current_user.id, current_user.email)
+    return settings
+
+@router.get("/me/export")
+async def export_history(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    db=Depends(get_database),
+    current_user: User = Depends(get_current_user)
+):
+    if format == "csv":
+        body, media_type = export_csv(db, current_user.id), "text/csv"
+    else:
+        body, media_type = export_ndjson(db, current_user.id), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="mindful-export.{format}"'},
+    )
+
+@router.post("/me/import", response_model=dict)
+async def import_history(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    db=Depends(get_database),
+    current_user: User = Depends(get_current_user)
+):
+    parse = parse_csv if format == "csv" else parse_ndjson
+    try:
+        return await import_records(db, current_user.id, parse(request.stream()))
+    finally:
+        await response_cache.bump(current_user.id)
+        events.emit(current_user.id, {"type": "resync"})
@@ -0,0 +1,213 @@
+"""
+Cold storage for old todos.
+
+Todos whose due date is more than TODO_ARCHIVE_AFTER_DAYS in the past are
+moved out of `todos` into one `todo_archive` document per user and month:
+
+    {"_id": "<user id>:2024-03", "user_id": ..., "month": "2024-03",
+     "habit_ids": [...], "habits": {"<habit id>": {"due": <int>, "done": <int>}}}
+
+Bit d-1 of `due` is set if the habit had a todo on day d of the month and
+the same bit of `done` if it was completed. That is all progress, streaks
+and exports need, so code that recomputes them from history reads both
+tiers through `archived_days` / `archived_counts`. Progress counters, day
+rollups and streak states are not touched by archiving.
+
+Archived todos are gone from `todos`, so like any deleted todo they leave
+a tombstone for the clients syncing through GET /todos/changes. Moving a
+batch ORs its bits into the archive and writes the tombstones before
+deleting the todos, so a batch interrupted in between is simply moved
+again. Run once with:
+
+    python -m app.archive
+"""
+import os
+import sys
+import asyncio
+import logging
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ENABLED = os.getenv("TODO_ARCHIVE_ENABLED", "true").lower() == "true"
+ARCHIVE_AFTER_DAYS = int(os.getenv("TODO_ARCHIVE_AFTER_DAYS", "120"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("TODO_ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("TODO_ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+metrics: Dict = {
+    "runs": 0,
+    "todos_archived": 0,
+    "errors": 0,
+    "last_run_finished_at": None,
+    "last_error": None,
+}
+
+
+def month_key(day: datetime) -> str:
+    return day.strftime("%Y-%m")
+
+
+def archive_id(user_id: ObjectId, month: str) -> str:
+    return f"{user_id}:{month}"
+
+
+def archive_updates(todos: Iterable[Dict]) -> List[UpdateOne]:
+    """
+    One upsert per user and month that ORs the todos' days into the bitsets
+    of their habits.
+    """
+    months: Dict[tuple, Dict[ObjectId, List[int]]] = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    for todo in todos:
+        bits = months[(todo["user_id"], month_key(todo["due_date"]))][todo["habit_id"]]
+        bit = 1 << (todo["due_date"].day - 1)
+        bits[0] |= bit
+        if todo.get("completed"):
+            bits[1] |= bit
+
+    operations = []
+    for (user_id, month), habits in months.items():
+        update = {
+            "$bit": {},
+            "$addToSet": {"habit_ids": {"$each": list(habits)}},
+            "$setOnInsert": {"user_id": user_id, "month": month},
+        }
+        for habit_id, (due, done) in habits.items():
+            update["$bit"][f"habits.{habit_id}.due"] = {"or": due}
+            update["$bit"][f"habits.{habit_id}.done"] = {"or": done}
+        operations.append(UpdateOne({"_id": archive_id(user_id, month)}, update, upsert=True))
+    return operations
+
+
+async def archive_todos(db, cutoff: Optional[datetime] = None) -> int:
+    """
+    Moves every habit todo due before `cutoff` into the archive, batch by
+    batch. Returns the number of todos moved.
+    """
+    # todo_service needs this module through the counters and streaks
+    from app.todo_service import delete_tombstones, now_ms
+
+    if cutoff is None:
+        cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    query = {"due_date": {"$lt": cutoff}, "habit_id": {"$type": "objectId"}}
+
+    moved = 0
+    while True:
+        todos = await db.todos.find(
+            query, {"user_id": 1, "habit_id": 1, "due_date": 1, "completed": 1}
+        ).limit(ARCHIVE_BATCH_SIZE).to_list(length=ARCHIVE_BATCH_SIZE)
+        if not todos:
+            break
+        await db.todo_archive.bulk_write(archive_updates(todos), ordered=False)
+        await delete_tombstones(db, todos, now_ms())
+        result = await db.todos.delete_many({"_id": {"$in": [todo["_id"] for todo in todos]}})
+        moved += result.deleted_count
+        metrics["todos_archived"] += result.deleted_count
+
+    metrics["runs"] += 1
+    metrics["last_run_finished_at"] = datetime.utcnow()
+    if moved:
+        logger.info("Archived %d todos due before %s", moved, cutoff.date())
+    return moved
+
+
+async def archived_days(db, query: Dict, habit_ids: Optional[Iterable[ObjectId]] = None) -> AsyncIterator[Dict]:
+    """
+    Yields the archived todos of the archive documents matching `query` as
+    {"user_id", "habit_id", "due_date", "completed"}, in month order and by
+    day within a month, optionally limited to `habit_ids`.
+    """
+    wanted = {str(habit_id) for habit_id in habit_ids} if habit_ids is not None else None
+    async for doc in db.todo_archive.find(query).sort("month", 1):
+        year, month = map(int, doc["month"].split("-"))
+        for key, bits in doc.get("habits", {}).items():
+            if wanted is not None and key not in wanted:
+                continue
+            habit_id = ObjectId(key)
+            due, done = bits.get("due", 0), bits.get("done", 0)
+            while due:
+                low = due & -due
+                yield {
+                    "user_id": doc["user_id"],
+                    "habit_id": habit_id,
+                    "due_date": datetime(year, month, low.bit_length()),
+                    "completed": bool(done & low),
+                }
+                due ^= low
+
+
+async def archived_counts(db, habit_ids: List[ObjectId]) -> Dict[ObjectId, List[int]]:
+    """
+    Returns [total, completed] archived todos per habit.
+    """
+    counts: Dict[ObjectId, List[int]] = {}
+    wanted = {str(habit_id) for habit_id in habit_ids}
+    async for doc in db.todo_archive.find({"habit_ids": {"$in": habit_ids}}, {"habits": 1}):
+        for key, bits in doc["habits"].items():
+            if key in wanted:
+                row = counts.setdefault(ObjectId(key), [0, 0])
+                row[0] += bits.get("due", 0).bit_count()
+                row[1] += (bits.get("done", 0) & bits.get("due", 0)).bit_count()
+    return counts
+
+
+async def forget_archived_habits(db, habit_ids: List[ObjectId]):
+    if habit_ids:
+        await db.todo_archive.update_many(
+            {"habit_ids": {"$in": habit_ids}},
+            {"$unset": {f"habits.{habit_id}": "" for habit_id in habit_ids}, "$pullAll": {"habit_ids": habit_ids}},
+        )
+
+
+class TodoArchiver:
+    """
+    Runs archive_todos every ARCHIVE_INTERVAL_SECONDS. Batches are
+    idempotent, so instances running at the same time only repeat work.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await archive_todos(self.db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics["errors"] += 1
+                metrics["last_error"] = str(e)
+                logger.exception("Todo archiving failed")
+            await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+async def main(argv: List[str]) -> int:
+    from app.database import connect
+
+    await archive_todos(connect())
+    return 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main(sys.argv[1:])))
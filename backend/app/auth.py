@@ -1,25 +1,44 @@
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from app.models import TokenData, User
 from app.database import get_database
+from app.cache import LRUCache
+from app.password_service import get_pwd_context
 from pymongo.database import Database
+from bson import ObjectId
 import os
+import time
 
 SECRET_KEY = os.getenv("SECRET_KEY", "a_super_secret_key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+# Authenticated users by token subject. The cache is per worker, so the TTL
+# bounds how long another worker can serve a user after it changed.
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login", auto_error=False)
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+def invalidate_user(user_id=None, email: str | None = None):
+    """
+    Drops a user from the principal cache. Call after changing a user document.
+    """
+    if user_id is not None:
+        user_cache.pop(f"id:{user_id}")
+    if email is not None:
+        user_cache.pop(f"email:{email}")
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -47,8 +66,34 @@ async def get_current_user(
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    
-    user = await db.users.find_one({"email": token_data.email})
+
+    # Tokens issued with a "uid" claim are looked up by primary key
+    user_id = payload.get("uid")
+    cache_key = f"id:{user_id}" if user_id else f"email:{token_data.email}"
+    cached_user = user_cache.get(cache_key)
+    if cached_user is not None:
+        return cached_user
+
+    if user_id and ObjectId.is_valid(user_id):
+        user = await db.users.find_one({"_id": ObjectId(user_id)})
+    else:
+        user = await db.users.find_one({"email": token_data.email})
     if user is None:
         raise credentials_exception
-    return User(**user)
\ No newline at end of file
+
+    current_user = User(**user)
+    # Never keep a user cached beyond the lifetime of the token
+    ttl = min(USER_CACHE_TTL_SECONDS, payload["exp"] - time.time()) if "exp" in payload else None
+    user_cache.set(cache_key, current_user, ttl=ttl)
+    return current_user
+
+async def get_stream_user(
+    token: str | None = Depends(optional_oauth2_scheme),
+    access_token: str | None = None,
+    db: Database = Depends(get_database),
+):
+    """
+    Like get_current_user, but also takes the token as ?access_token=, since
+    browsers cannot set headers on an EventSource.
+    """
+    return await get_current_user(token or access_token or "", db)
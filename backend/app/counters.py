@@ -0,0 +1,239 @@
+"""
+Denormalized progress counters.
+
+Habits and goals carry `todo_count` and `completed_count`, and
+`progress_days` holds one document per goal and day with `total` and
+`completed`. They are updated with `$inc` whenever todos are created,
+toggled or deleted, so goal progress and its history by day (see
+`goal_days`) are read without touching `todos`.
+
+Goal and habit counters are only incremented once they exist. New goals
+and habits start at zero; older ones get theirs from the rebuild job:
+
+    python -m app.counters [--user <user id>]
+"""
+import sys
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from app.dashboard import update_streaks
+from app.archive import archived_days
+
+logger = logging.getLogger(__name__)
+
+ZERO_COUNTS = {"todo_count": 0, "completed_count": 0}
+
+# (todo, change in total, change in completed)
+TodoDelta = Tuple[Dict, int, int]
+
+
+def day_key(todo: Dict) -> str:
+    return todo["due_date"].strftime("%Y-%m-%d")
+
+
+async def _goal_ids_of(db, todos: Iterable[Dict]) -> Dict[ObjectId, ObjectId]:
+    """
+    Maps habit ids to goal ids, reading habits only for todos created before
+    todos carried their goal_id.
+    """
+    goal_of = {}
+    unknown = set()
+    for todo in todos:
+        if todo.get("goal_id") is not None:
+            goal_of[todo["habit_id"]] = todo["goal_id"]
+        elif todo.get("habit_id") is not None:
+            unknown.add(todo["habit_id"])
+    unknown -= set(goal_of)
+    if unknown:
+        habits = await db.habits.find({"_id": {"$in": list(unknown)}}, {"goal_id": 1}).to_list(length=None)
+        goal_of.update({habit["_id"]: habit["goal_id"] for habit in habits})
+    return goal_of
+
+
+async def apply_todo_deltas(db, deltas: List[TodoDelta]):
+    """
+    Applies counter changes for a set of todo writes with one bulk write per
+    collection.
+    """
+    deltas = [delta for delta in deltas if delta[1] or delta[2]]
+    if not deltas:
+        return
+
+    goal_of = await _goal_ids_of(db, (todo for todo, _, _ in deltas))
+    habits: Dict[ObjectId, List[int]] = defaultdict(lambda: [0, 0])
+    goals: Dict[ObjectId, List[int]] = defaultdict(lambda: [0, 0])
+    days: Dict[Tuple[ObjectId, str], List] = {}
+    for todo, total, completed in deltas:
+        goal_id = goal_of.get(todo.get("habit_id"))
+        if goal_id is None:
+            continue
+        for counts in (habits[todo["habit_id"]], goals[goal_id]):
+            counts[0] += total
+            counts[1] += completed
+        day = days.setdefault((goal_id, day_key(todo)), [todo["user_id"], 0, 0])
+        day[1] += total
+        day[2] += completed
+
+    def counter_updates(counts: Dict[ObjectId, List[int]]):
+        return [
+            UpdateOne(
+                {"_id": _id, "todo_count": {"$exists": True}},
+                {"$inc": {"todo_count": total, "completed_count": completed}},
+            )
+            for _id, (total, completed) in counts.items()
+        ]
+
+    if habits:
+        await db.habits.bulk_write(counter_updates(habits), ordered=False)
+    if goals:
+        await db.goals.bulk_write(counter_updates(goals), ordered=False)
+    if days:
+        await db.progress_days.bulk_write([
+            UpdateOne(
+                {"goal_id": goal_id, "day": day},
+                {"$inc": {"total": total, "completed": completed}, "$setOnInsert": {"user_id": user_id}},
+                upsert=True,
+            )
+            for (goal_id, day), (user_id, total, completed) in days.items()
+        ], ordered=False)
+
+    await update_streaks(db, deltas)
+
+
+async def forget_archived_counts(db, goal_id: ObjectId, habit_ids: List[ObjectId]):
+    """
+    Takes the archived days of removed habits out of the goal's counters and
+    day rollups. Their live todos are counted out as they are deleted.
+    """
+    if not habit_ids:
+        return
+    by_day: Dict[str, Dict] = {}
+    async for todo in archived_days(db, {"habit_ids": {"$in": habit_ids}}, habit_ids):
+        day = by_day.setdefault(day_key(todo), {"_id": day_key(todo), "total": 0, "completed": 0})
+        day["total"] += 1
+        day["completed"] += todo["completed"]
+    per_day = list(by_day.values())
+    if not per_day:
+        return
+
+    total = sum(day["total"] for day in per_day)
+    completed = sum(day["completed"] for day in per_day)
+    await db.goals.update_one(
+        {"_id": goal_id, "todo_count": {"$exists": True}},
+        {"$inc": {"todo_count": -total, "completed_count": -completed}},
+    )
+    await db.progress_days.bulk_write([
+        UpdateOne({"goal_id": goal_id, "day": day["_id"]}, {"$inc": {"total": -day["total"], "completed": -day["completed"]}})
+        for day in per_day
+    ], ordered=False)
+
+
+async def goal_days(db, goal_id: ObjectId, since: date) -> List[Dict]:
+    """
+    The goal's todo totals per day from `since` on, oldest first. Days
+    without todos are left out.
+    """
+    return await db.progress_days.find(
+        {"goal_id": goal_id, "day": {"$gte": since.strftime("%Y-%m-%d")}, "total": {"$gt": 0}},
+        {"_id": 0, "day": 1, "total": 1, "completed": 1},
+    ).sort("day", 1).to_list(length=None)
+
+
+async def rebuild_counters(db, user_id: Optional[ObjectId] = None):
+    """
+    Recomputes every counter and day rollup from `todos` and the archive,
+    for one user or for everyone.
+    """
+    goal_filter = {"user_id": user_id} if user_id else {}
+    todo_match = {"user_id": user_id} if user_id else {}
+
+    habit_counts: Dict[ObjectId, List[int]] = defaultdict(lambda: [0, 0])
+    day_counts: Dict[Tuple[ObjectId, str], List[int]] = defaultdict(lambda: [0, 0])
+    rows = db.todos.aggregate([
+        {"$match": {**todo_match, "habit_id": {"$type": "objectId"}}},
+        {"$group": {
+            "_id": {"habit_id": "$habit_id", "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$due_date"}}},
+            "total": {"$sum": 1},
+            "completed": {"$sum": {"$cond": ["$completed", 1, 0]}},
+        }},
+    ], allowDiskUse=True)
+    async for row in rows:
+        counts = habit_counts[row["_id"]["habit_id"]]
+        counts[0] += row["total"]
+        counts[1] += row["completed"]
+        day_counts[(row["_id"]["habit_id"], row["_id"]["day"])] = [row["total"], row["completed"]]
+    async for todo in archived_days(db, todo_match):
+        counts = habit_counts[todo["habit_id"]]
+        counts[0] += 1
+        counts[1] += todo["completed"]
+        day = day_counts[(todo["habit_id"], day_key(todo))]
+        day[0] += 1
+        day[1] += todo["completed"]
+
+    goals = await db.goals.find(goal_filter, {"user_id": 1}).to_list(length=None)
+    owner_of = {goal["_id"]: goal["user_id"] for goal in goals}
+    habits = await db.habits.find({"goal_id": {"$in": list(owner_of)}}, {"goal_id": 1}).to_list(length=None)
+    goal_of = {habit["_id"]: habit["goal_id"] for habit in habits}
+
+    goal_counts: Dict[ObjectId, List[int]] = {goal_id: [0, 0] for goal_id in owner_of}
+    goal_days: Dict[Tuple[ObjectId, str], List[int]] = defaultdict(lambda: [0, 0])
+    for habit_id, goal_id in goal_of.items():
+        total, completed = habit_counts.get(habit_id, (0, 0))
+        goal_counts[goal_id][0] += total
+        goal_counts[goal_id][1] += completed
+    for (habit_id, day), (total, completed) in day_counts.items():
+        goal_id = goal_of.get(habit_id)
+        if goal_id is not None:
+            goal_days[(goal_id, day)][0] += total
+            goal_days[(goal_id, day)][1] += completed
+
+    def set_counts(ids, counts):
+        return [
+            UpdateOne({"_id": _id}, {"$set": {"todo_count": counts.get(_id, (0, 0))[0], "completed_count": counts.get(_id, (0, 0))[1]}})
+            for _id in ids
+        ]
+
+    if goal_of:
+        await db.habits.bulk_write(set_counts(goal_of, habit_counts), ordered=False)
+    if goal_counts:
+        await db.goals.bulk_write(set_counts(goal_counts, goal_counts), ordered=False)
+
+    # Rollups are overwritten in place rather than deleted and reinserted,
+    # so live $inc upserts never find a day missing or collide on insert.
+    # Days that no longer have todos are zeroed.
+    existing = db.progress_days.find({"goal_id": {"$in": list(owner_of)}} if user_id else {}, {"goal_id": 1, "day": 1})
+    async for rollup in existing:
+        goal_days.setdefault((rollup["goal_id"], rollup["day"]), [0, 0])
+    rollups = [
+        UpdateOne(
+            {"goal_id": goal_id, "day": day},
+            {"$set": {"total": total, "completed": completed}, "$setOnInsert": {"user_id": owner_of[goal_id]}},
+            upsert=True,
+        )
+        for (goal_id, day), (total, completed) in goal_days.items()
+        if goal_id in owner_of
+    ]
+    for i in range(0, len(rollups), 10000):
+        await db.progress_days.bulk_write(rollups[i:i + 10000], ordered=False)
+
+    logger.info("Rebuilt counters for %d goals, %d habits, %d goal days", len(goal_counts), len(goal_of), len(rollups))
+
+
+async def main(argv: List[str]) -> int:
+    from app.database import connect
+
+    user_id = ObjectId(argv[argv.index("--user") + 1]) if "--user" in argv else None
+    await rebuild_counters(connect(), user_id)
+    return 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,279 @@
+"""
+Streaks and rolling completion rates, kept as a compact state per habit.
+
+Every habit carries a `streak` document: two bitsets over the last
+WINDOW_DAYS days (which days had a todo, which were completed) anchored at
+the newest day seen, plus the length of the completed run just older than
+the window and the longest run that has already left it. A streak counts
+consecutive completed todos; days without a todo neither extend nor break
+it, and today's open todo does not break it yet.
+
+Todo writes update the state through `update_streaks`, so the dashboard
+never reads todo history. `rebuild_streaks` replays history from `todos`
+for habits created before this state existed or to repair it:
+
+    python -m app.dashboard [--user <user id>]
+"""
+import sys
+import asyncio
+import logging
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from app.archive import archived_days
+
+logger = logging.getLogger(__name__)
+
+WINDOW_DAYS = 60
+RATE_DAYS = 30
+MASK = (1 << WINDOW_DAYS) - 1
+MAX_ATTEMPTS = 3
+REBUILD_BATCH_SIZE = 1000
+
+
+def empty_streak() -> Dict:
+    return {"anchor": None, "due": 0, "done": 0, "overflow": 0, "longest_dropped": 0, "version": 0}
+
+
+def _advance(state: Dict, day: int):
+    """
+    Moves the window forward so it ends at `day`, folding the days that fall
+    out of it into `overflow` and `longest_dropped`.
+    """
+    shift = day - state["anchor"]
+    if shift <= 0:
+        return
+    # Oldest first, so overflow ends up as the run ending at the newest dropped day
+    for i in range(WINDOW_DAYS - 1, max(WINDOW_DAYS - shift, 0) - 1, -1):
+        if state["due"] >> i & 1:
+            state["overflow"] = state["overflow"] + 1 if state["done"] >> i & 1 else 0
+            state["longest_dropped"] = max(state["longest_dropped"], state["overflow"])
+    state["due"] = (state["due"] << shift) & MASK
+    state["done"] = (state["done"] << shift) & MASK
+    state["anchor"] = day
+
+
+def apply_day(state: Dict, day: int, due: bool, done: bool) -> bool:
+    """
+    Records whether a todo exists and is completed on `day` (a date ordinal).
+    Returns False when the day is older than the window; such changes are
+    only picked up by a rebuild.
+    """
+    if state["anchor"] is None:
+        state["anchor"] = day
+    _advance(state, day)
+    i = state["anchor"] - day
+    if i >= WINDOW_DAYS:
+        return False
+    bit = 1 << i
+    state["due"] = state["due"] | bit if due else state["due"] & ~bit
+    state["done"] = state["done"] | bit if due and done else state["done"] & ~bit
+    return True
+
+
+def summarize_streak(state: Optional[Dict], today: int) -> Dict:
+    if not state or state["anchor"] is None:
+        return {"current_streak": 0, "longest_streak": 0, "completed_30d": 0, "due_30d": 0}
+
+    run = state["overflow"]
+    longest = max(state["longest_dropped"], run)
+    completed, due = 0, 0
+    for i in range(WINDOW_DAYS - 1, -1, -1):
+        if not state["due"] >> i & 1:
+            continue
+        day = state["anchor"] - i
+        done = bool(state["done"] >> i & 1)
+        if today - RATE_DAYS < day <= today:
+            due += 1
+            completed += done
+        if done:
+            run += 1
+            longest = max(longest, run)
+        elif day < today:
+            run = 0
+    return {"current_streak": run, "longest_streak": longest, "completed_30d": completed, "due_30d": due}
+
+
+def _changes_from_deltas(deltas) -> Dict[ObjectId, Dict[datetime, Tuple[bool, bool]]]:
+    changes: Dict[ObjectId, Dict[datetime, Tuple[bool, bool]]] = {}
+    for todo, total, completed in deltas:
+        if todo.get("habit_id") is None:
+            continue
+        if total < 0:
+            change = (False, False)
+        elif completed:
+            change = (True, completed > 0)
+        else:
+            change = (True, bool(todo.get("completed")))
+        changes.setdefault(todo["habit_id"], {})[todo["due_date"]] = change
+    return changes
+
+
+async def _current_changes(db, changes: Dict[ObjectId, Dict[datetime, Tuple[bool, bool]]]) -> Dict:
+    """
+    The same days as `changes`, with the state their todos have now instead
+    of the one captured with the write.
+    """
+    due_dates = {due_date for days in changes.values() for due_date in days}
+    todos = await db.todos.find(
+        {"habit_id": {"$in": list(changes)}, "due_date": {"$in": list(due_dates)}},
+        {"habit_id": 1, "due_date": 1, "completed": 1},
+    ).to_list(length=None)
+    current = {(todo["habit_id"], todo["due_date"]): bool(todo["completed"]) for todo in todos}
+    return {
+        habit_id: {
+            due_date: ((habit_id, due_date) in current, current.get((habit_id, due_date), False))
+            for due_date in days
+        }
+        for habit_id, days in changes.items()
+    }
+
+
+async def update_streaks(db, deltas):
+    """
+    Applies todo writes, given as (todo, change in total, change in
+    completed) like the progress counters, to the streak state of their
+    habits. Habits whose write lost a race on the version are retried with
+    their todos as they are now, so a concurrent opposite toggle is not
+    undone by replaying the stale change.
+    """
+    changes = _changes_from_deltas(deltas)
+    for attempt in range(MAX_ATTEMPTS):
+        if not changes:
+            return
+        if attempt:
+            changes = await _current_changes(db, changes)
+        habits = await db.habits.find(
+            {"_id": {"$in": list(changes)}, "streak": {"$exists": True}}, {"streak": 1}
+        ).to_list(length=None)
+        written = {}
+        operations = []
+        for habit in habits:
+            state = dict(habit["streak"])
+            for due_date, (due, done) in changes[habit["_id"]].items():
+                apply_day(state, due_date.date().toordinal(), due, done)
+            version = state["version"]
+            state["version"] = version + 1
+            written[habit["_id"]] = state
+            operations.append(UpdateOne({"_id": habit["_id"], "streak.version": version}, {"$set": {"streak": state}}))
+        if not operations:
+            return
+        result = await db.habits.bulk_write(operations, ordered=False)
+        if result.matched_count == len(operations):
+            return
+        # A habit whose stored state is not the one written lost the race (or
+        # was written again since, which the retry's fresh read also covers)
+        stored = await db.habits.find({"_id": {"$in": list(written)}}, {"streak": 1}).to_list(length=None)
+        changes = {
+            habit["_id"]: changes[habit["_id"]]
+            for habit in stored
+            if habit.get("streak") != written[habit["_id"]]
+        }
+    if changes:
+        logger.warning("Streak update for %d habits kept conflicting; run a rebuild", len(changes))
+
+
+async def _rebuild_batch(db, habit_ids: List[ObjectId]) -> int:
+    states = {habit_id: empty_streak() for habit_id in habit_ids}
+    # Archived days are older than anything still in `todos`
+    async for todo in archived_days(db, {"habit_ids": {"$in": habit_ids}}, habit_ids):
+        apply_day(states[todo["habit_id"]], todo["due_date"].date().toordinal(), True, todo["completed"])
+    cursor = db.todos.find(
+        {"habit_id": {"$in": habit_ids}}, {"habit_id": 1, "due_date": 1, "completed": 1}
+    ).sort([("habit_id", 1), ("due_date", 1)]).batch_size(5000)
+    async for todo in cursor:
+        apply_day(states[todo["habit_id"]], todo["due_date"].date().toordinal(), True, bool(todo["completed"]))
+
+    operations = [UpdateOne({"_id": habit_id}, {"$set": {"streak": state}}) for habit_id, state in states.items()]
+    await db.habits.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+async def rebuild_streaks(db, habit_ids: Optional[List[ObjectId]] = None, user_id: Optional[ObjectId] = None):
+    """
+    Replays todo history, archived days first, into fresh streak states.
+    Habits are rebuilt REBUILD_BATCH_SIZE at a time in _id order, and their
+    todos are streamed in (habit_id, due_date) order off the unique todo
+    index, so memory use does not depend on the number of habits or the
+    length of their history.
+    """
+    if habit_ids is not None:
+        query = {"_id": {"$in": habit_ids}}
+    elif user_id is not None:
+        query = {"goal_id": {"$in": await db.goals.distinct("_id", {"user_id": user_id})}}
+    else:
+        query = {}
+
+    rebuilt = 0
+    batch: List[ObjectId] = []
+    cursor = db.habits.find(query, {"_id": 1}).sort("_id", 1).batch_size(REBUILD_BATCH_SIZE)
+    async for habit in cursor:
+        batch.append(habit["_id"])
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            rebuilt += await _rebuild_batch(db, batch)
+            batch = []
+    if batch:
+        rebuilt += await _rebuild_batch(db, batch)
+    logger.info("Rebuilt streaks for %d habits", rebuilt)
+
+
+async def get_summary(db, user_id: ObjectId) -> Dict:
+    """
+    Current and longest streak and 30-day completion rate for every habit of
+    the user's goals that are not completed, plus the overall rate.
+    """
+    goals = await db.goals.find(
+        {"user_id": user_id, "status": {"$ne": "completed"}, "deleted_at": None}, {"_id": 1}
+    ).to_list(length=None)
+    habits = await db.habits.find(
+        {"goal_id": {"$in": [goal["_id"] for goal in goals]}},
+        {"description": 1, "frequency": 1, "goal_id": 1, "streak": 1},
+    ).to_list(length=None)
+
+    missing = [habit["_id"] for habit in habits if "streak" not in habit]
+    if missing:
+        await rebuild_streaks(db, missing)
+        rebuilt = await db.habits.find({"_id": {"$in": missing}}, {"streak": 1}).to_list(length=None)
+        states = {habit["_id"]: habit["streak"] for habit in rebuilt}
+        for habit in habits:
+            if habit["_id"] in states:
+                habit["streak"] = states[habit["_id"]]
+
+    today = date.today().toordinal()
+    summaries = []
+    completed, due = 0, 0
+    for habit in habits:
+        streak = summarize_streak(habit.get("streak"), today)
+        completed += streak["completed_30d"]
+        due += streak["due_30d"]
+        summaries.append({
+            "_id": habit["_id"],
+            "goal_id": habit["goal_id"],
+            "description": habit["description"],
+            "frequency": habit["frequency"],
+            "current_streak": streak["current_streak"],
+            "longest_streak": streak["longest_streak"],
+            "completion_rate_30d": (streak["completed_30d"] / streak["due_30d"]) * 100 if streak["due_30d"] else 0,
+        })
+
+    return {
+        "completion_rate_30d": (completed / due) * 100 if due else 0,
+        "habits": summaries,
+    }
+
+
+async def main(argv: List[str]) -> int:
+    from app.database import connect
+
+    user_id = ObjectId(argv[argv.index("--user") + 1]) if "--user" in argv else None
+    await rebuild_streaks(connect(), user_id=user_id)
+    return 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -1,24 +1,140 @@
 import os
 import urllib.parse
-from pymongo import MongoClient
-from motor.motor_asyncio import AsyncIOMotorClient
+from typing import Dict, Optional
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import ReadPreference, monitoring
+from app.metrics import command_listener
+
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "habit_builder")
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
 
 def get_mongo_url():
+    # A full URL wins, e.g. mongodb://localhost:27017 for a local mongod
+    url = os.getenv("MONGO_URL")
+    if url:
+        return url
+
     username = os.getenv("MONGO_USERNAME")
     password = os.getenv("MONGO_PASSWORD")
     host = os.getenv("MONGO_HOST")
-    
+    if not (username and password and host):
+        return "mongodb://localhost:27017"
+
     encoded_password = urllib.parse.quote_plus(password)
-    
+
     return f"mongodb+srv://{username}:{encoded_password}@{host}/?retryWrites=true&w=majority&appName=Cluster0"
 
-MONGO_DETAILS = get_mongo_url()
+def get_client_options() -> Dict:
+    """
+    Connection pool, timeout and compression settings from the environment.
+    """
+    options = {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000")),
+        "event_listeners": [pool_listener, command_listener],
+    }
+    if os.getenv("MONGO_SOCKET_TIMEOUT_MS"):
+        options["socketTimeoutMS"] = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS"))
+    if os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS"):
+        options["waitQueueTimeoutMS"] = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS"))
+    # e.g. "zstd,snappy,zlib"; the server picks the first one it supports
+    if os.getenv("MONGO_COMPRESSORS"):
+        options["compressors"] = os.getenv("MONGO_COMPRESSORS")
+    return options
+
+pool_metrics: Dict = {
+    "connections_open": 0,
+    "connections_checked_out": 0,
+    "connections_created": 0,
+    "connections_closed": 0,
+    "checkouts": 0,
+    "checkouts_waiting": 0,
+    "checkout_failures": 0,
+}
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pool_metrics["connections_created"] += 1
+        pool_metrics["connections_open"] += 1
 
-client = AsyncIOMotorClient(MONGO_DETAILS)
+    def connection_ready(self, event):
+        pass
 
-database = client.habit_builder
+    def connection_closed(self, event):
+        pool_metrics["connections_closed"] += 1
+        pool_metrics["connections_open"] -= 1
 
-user_collection = database.get_collection("users")
+    def connection_check_out_started(self, event):
+        pool_metrics["checkouts_waiting"] += 1
+
+    def connection_check_out_failed(self, event):
+        pool_metrics["checkouts_waiting"] -= 1
+        pool_metrics["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        pool_metrics["checkouts_waiting"] -= 1
+        pool_metrics["checkouts"] += 1
+        pool_metrics["connections_checked_out"] += 1
+
+    def connection_checked_in(self, event):
+        pool_metrics["connections_checked_out"] -= 1
+
+pool_listener = PoolMetricsListener()
+
+client: Optional[AsyncIOMotorClient] = None
+database: Optional[AsyncIOMotorDatabase] = None
+stats_database: Optional[AsyncIOMotorDatabase] = None
+
+def connect():
+    """
+    Creates the Mongo client. Called from the app lifespan, so importing the
+    app does not open connections.
+    """
+    global client, database, stats_database
+    if client is not None:
+        return database
+
+    client = AsyncIOMotorClient(get_mongo_url(), **get_client_options())
+    database = client[MONGO_DB_NAME]
+    # Dashboard and stats reads tolerate slightly stale data and can be
+    # served by secondaries
+    read_preference = READ_PREFERENCES[os.getenv("MONGO_STATS_READ_PREFERENCE", "primary")]
+    stats_database = database.with_options(read_preference=read_preference)
+    return database
+
+def close():
+    global client, database, stats_database
+    if client is not None:
+        client.close()
+    client = database = stats_database = None
 
 async def get_database():
     return database
+
+def reads_primary(db) -> bool:
+    return db.read_preference == ReadPreference.PRIMARY
+
+async def get_stats_database():
+    return stats_database
@@ -0,0 +1,278 @@
+"""
+Live updates for connected clients.
+
+GET /api/v1/events streams server-sent events to a user's open tabs and
+devices, so they stay current without polling. Events are JSON objects
+with a `type`:
+
+- todo / goal: the changed document, as GET /todos/ and GET /goals/{id}
+  return it
+- todo_deleted / goal_deleted: the `id` of the deleted document
+- changed: many documents of a `scope` ("todos" or "goals") changed; pull
+  GET /todos/changes or refetch the goals
+- resync: events were dropped, refetch everything
+
+Where the events come from is set with EVENTS_SOURCE:
+
+- changestream: one Mongo change stream per worker on todos, todo
+  tombstones and goals. It sees writes made by every instance and job.
+- local: the API handlers publish their own writes through `emit`. Only
+  clients connected to the worker that made the write hear about it.
+- auto (default): changestream when the server supports it (replica sets),
+  otherwise local.
+
+Every connection has a queue of EVENTS_QUEUE_SIZE events. A client that
+falls that far behind gets its queue replaced by a single resync event
+instead of holding memory for it.
+"""
+import os
+import asyncio
+import logging
+from typing import Dict, Optional, Set
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from app.models import Goal, Todo
+from app.serialization import shape, to_json
+
+logger = logging.getLogger(__name__)
+
+EVENTS_SOURCE = os.getenv("EVENTS_SOURCE", "auto")
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "5000"))
+# Open tabs and devices of one user, so no user can take all the slots
+EVENTS_MAX_PER_USER = int(os.getenv("EVENTS_MAX_PER_USER", "5"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "25"))
+# Tells EventSource how long to wait before reconnecting
+EVENTS_RETRY_MS = 5000
+
+WATCHED = ["todos", "todo_tombstones", "goals"]
+CHANGE_STREAM_HISTORY_LOST = 286
+# Goal fields that change with every todo toggle and are not shown by the
+# goal itself
+GOAL_BOOKKEEPING = {"todo_count", "completed_count", "purge_locked_by", "purge_locked_until", "removed_habit_ids"}
+
+metrics: Dict = {
+    "subscribers": 0,
+    "published": 0,
+    "delivered": 0,
+    "overflows": 0,
+    "rejected": 0,
+    "change_stream_errors": 0,
+}
+
+
+class Subscription:
+    def __init__(self, user_id: ObjectId, size: int = EVENTS_QUEUE_SIZE):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+
+    def put(self, event: Dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            metrics["overflows"] += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+
+class EventBus:
+    def __init__(self, max_subscribers: int = EVENTS_MAX_SUBSCRIBERS, max_per_user: int = EVENTS_MAX_PER_USER):
+        self.max_subscribers = max_subscribers
+        self.max_per_user = max_per_user
+        self._subscribers: Dict[ObjectId, Set[Subscription]] = {}
+        self._count = 0
+
+    def subscribe(self, user_id: ObjectId) -> Optional[Subscription]:
+        """
+        Returns None when the worker already has max_subscribers, or the
+        user max_per_user.
+        """
+        if self._count >= self.max_subscribers or len(self._subscribers.get(user_id, ())) >= self.max_per_user:
+            metrics["rejected"] += 1
+            return None
+        subscription = Subscription(user_id)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        self._count += 1
+        metrics["subscribers"] = self._count
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscribers.get(subscription.user_id)
+        if subscriptions and subscription in subscriptions:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.user_id]
+            self._count -= 1
+            metrics["subscribers"] = self._count
+
+    def publish(self, user_id: ObjectId, event: Dict):
+        metrics["published"] += 1
+        for subscription in self._subscribers.get(user_id, ()):
+            subscription.put(event)
+            metrics["delivered"] += 1
+
+    def broadcast(self, event: Dict):
+        for user_id in list(self._subscribers):
+            self.publish(user_id, event)
+
+
+bus = EventBus()
+# "local" or "changestream" once the lifespan has started the events
+source = "local"
+
+
+def emit(user_id: ObjectId, event: Dict):
+    """
+    Publishes an event for a write made by this worker. A no-op when the
+    change stream delivers writes instead.
+    """
+    if source == "local":
+        bus.publish(user_id, event)
+
+
+def todo_event(todo: Dict) -> Dict:
+    return {"type": "todo", "todo": shape(todo, Todo)}
+
+
+def goal_event(goal: Dict) -> Dict:
+    if goal.get("deleted_at") is not None:
+        return {"type": "goal_deleted", "id": str(goal["_id"])}
+    return {"type": "goal", "goal": shape(goal, Goal)}
+
+
+def change_event(change: Dict) -> Optional[tuple]:
+    """
+    Translates a change stream event into (user id, event), or None if
+    clients do not need to hear about it.
+    """
+    collection = change["ns"]["coll"]
+    operation = change["operationType"]
+    document = change.get("fullDocument")
+    if operation not in ("insert", "update", "replace") or document is None:
+        return None
+    if collection == "todos":
+        return document["user_id"], todo_event(document)
+    if collection == "todo_tombstones":
+        return document["user_id"], {"type": "todo_deleted", "id": str(document["todo_id"])}
+    if collection == "goals":
+        updated = change.get("updateDescription", {}).get("updatedFields", {})
+        if operation == "update" and {field.split(".")[0] for field in updated} <= GOAL_BOOKKEEPING:
+            return None
+        return document["user_id"], goal_event(document)
+    return None
+
+
+class ChangeStreamWatcher:
+    """
+    Feeds the bus from a change stream, resuming after errors from the last
+    event seen. When it cannot resume, every client is told to resync.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._task: Optional[asyncio.Task] = None
+        self._resume_token = None
+
+    def _watch(self):
+        return self.db.watch(
+            [{"$match": {"ns.coll": {"$in": WATCHED}}}],
+            full_document="updateLookup",
+            resume_after=self._resume_token,
+        )
+
+    def start(self, stream=None):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(stream))
+
+    def _handle(self, change: Dict):
+        self._resume_token = change["_id"]
+        translated = change_event(change)
+        if translated is not None:
+            bus.publish(*translated)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self, stream):
+        while True:
+            try:
+                if stream is None:
+                    stream = self._watch()
+                async with stream:
+                    async for change in stream:
+                        self._handle(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics["change_stream_errors"] += 1
+                logger.warning("Change stream failed, reopening: %s", e)
+                if not isinstance(e, PyMongoError) or getattr(e, "code", None) == CHANGE_STREAM_HISTORY_LOST:
+                    # Cannot resume where it stopped, so events may have been missed
+                    self._resume_token = None
+                    bus.broadcast({"type": "resync"})
+                await asyncio.sleep(1)
+            stream = None
+
+
+watcher: Optional[ChangeStreamWatcher] = None
+
+
+async def start(db):
+    global source, watcher
+    if EVENTS_SOURCE in ("auto", "changestream"):
+        candidate = ChangeStreamWatcher(db)
+        try:
+            # Opening the stream fails on servers without change streams
+            stream = candidate._watch()
+            first = await stream.try_next()
+        except Exception as e:
+            # Standalone servers refuse change streams; mongomock (the load
+            # test's --in-memory mode) has none at all
+            if EVENTS_SOURCE == "changestream":
+                raise
+            logger.info("Change streams unavailable, publishing events locally: %s", e)
+        else:
+            watcher = candidate
+            if first is not None:
+                watcher._handle(first)
+            watcher.start(stream)
+            source = "changestream"
+            return
+    source = "local"
+
+
+async def stop():
+    global watcher
+    if watcher is not None:
+        await watcher.stop()
+    watcher = None
+
+
+def format_event(event: Dict) -> bytes:
+    return b"event: " + event["type"].encode() + b"\ndata: " + to_json(event) + b"\n\n"
+
+
+async def stream(subscription: Subscription, heartbeat: float = EVENTS_HEARTBEAT_SECONDS):
+    """
+    Yields the server-sent events of a subscription, with a comment line
+    every `heartbeat` seconds so proxies keep the connection open and a
+    closed one is noticed. Unsubscribes when the client goes away.
+    """
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n".encode() + format_event({"type": "ready"})
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        bus.unsubscribe(subscription)
@@ -0,0 +1,282 @@
+"""
+Export and import of a user's goals, habits and todos.
+
+Both formats hold one record per line (or CSV row), each tagged with its
+`type`. Goals come before their habits and habits before their todos, so an
+import can map old ids to new ones in a single pass. Records are read from
+Motor cursors and written in chunks of EXPORT_BATCH_SIZE, and imports are
+parsed line by line from the request body and inserted in batches, so
+memory use does not grow with history length. Only the id mapping of goals
+and habits is kept during an import.
+"""
+import io
+import os
+import csv
+import json
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError
+from app.counters import ZERO_COUNTS, rebuild_counters
+from app.dashboard import rebuild_streaks, empty_streak
+from app.todo_service import DUPLICATE_KEY_ERROR, now_ms
+from app.purge import NOT_DELETED
+from app.archive import archived_days
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+CSV_FIELDS = [
+    "type", "id", "goal_id", "habit_id", "description", "frequency", "category",
+    "status", "completion_date", "due_date", "completed",
+]
+
+
+def _goal_record(goal: Dict) -> Dict:
+    return {
+        "type": "goal",
+        "id": str(goal["_id"]),
+        "description": goal["description"],
+        "category": goal.get("category"),
+        "status": goal.get("status", "in_progress"),
+        "completion_date": goal["completion_date"].isoformat() if goal.get("completion_date") else None,
+    }
+
+
+def _habit_record(habit: Dict) -> Dict:
+    return {
+        "type": "habit",
+        "id": str(habit["_id"]),
+        "goal_id": str(habit["goal_id"]),
+        "description": habit["description"],
+        "frequency": habit["frequency"],
+    }
+
+
+def _todo_record(todo: Dict) -> Dict:
+    return {
+        "type": "todo",
+        "id": str(todo["_id"]),
+        "goal_id": str(todo["goal_id"]) if todo.get("goal_id") else None,
+        "habit_id": str(todo["habit_id"]) if todo.get("habit_id") else None,
+        "description": todo["description"],
+        "due_date": todo["due_date"].isoformat(),
+        "completed": bool(todo.get("completed")),
+    }
+
+
+async def export_records(db, user_id: ObjectId) -> AsyncIterator[List[Dict]]:
+    """
+    Yields the user's records in batches: each batch of goals is followed by
+    the habits of those goals, then the archived todos and then the others,
+    each in due date order. Archived todos get fresh ids and the description
+    of their habit.
+    """
+    goals = db.goals.find({"user_id": user_id, **NOT_DELETED}).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+    batch: List[Dict] = []
+
+    async def flush_goals():
+        records = [_goal_record(goal) for goal in batch]
+        habits = db.habits.find(
+            {"goal_id": {"$in": [goal["_id"] for goal in batch]}},
+            {"goal_id": 1, "description": 1, "frequency": 1},
+        ).batch_size(EXPORT_BATCH_SIZE)
+        async for habit in habits:
+            records.append(_habit_record(habit))
+        return records
+
+    async for goal in goals:
+        batch.append(goal)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield await flush_goals()
+            batch = []
+    if batch:
+        yield await flush_goals()
+
+    records = []
+    habits: Dict[ObjectId, Optional[Dict]] = {}
+    async for todo in archived_days(db, {"user_id": user_id}):
+        if todo["habit_id"] not in habits:
+            habits[todo["habit_id"]] = await db.habits.find_one({"_id": todo["habit_id"]}, {"goal_id": 1, "description": 1})
+        habit = habits[todo["habit_id"]]
+        if habit is None:
+            continue
+        records.append(_todo_record({**todo, "_id": ObjectId(), "goal_id": habit["goal_id"], "description": habit["description"]}))
+        if len(records) >= EXPORT_BATCH_SIZE:
+            yield records
+            records = []
+
+    todos = db.todos.find(
+        {"user_id": user_id},
+        {"goal_id": 1, "habit_id": 1, "description": 1, "due_date": 1, "completed": 1},
+    ).sort("due_date", 1).batch_size(EXPORT_BATCH_SIZE)
+    async for todo in todos:
+        records.append(_todo_record(todo))
+        if len(records) >= EXPORT_BATCH_SIZE:
+            yield records
+            records = []
+    if records:
+        yield records
+
+
+async def export_ndjson(db, user_id: ObjectId) -> AsyncIterator[str]:
+    async for records in export_records(db, user_id):
+        yield "".join(json.dumps(record) + "\n" for record in records)
+
+
+async def export_csv(db, user_id: ObjectId) -> AsyncIterator[str]:
+    yield ",".join(CSV_FIELDS) + "\r\n"
+    async for records in export_records(db, user_id):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS)
+        writer.writerows(records)
+        yield buffer.getvalue()
+
+
+async def _lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    pending = b""
+    async for chunk in stream:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8")
+    if pending:
+        yield pending.decode("utf-8")
+
+
+async def parse_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator[Dict]:
+    async for line in _lines(stream):
+        if line.strip():
+            yield json.loads(line)
+
+
+async def parse_csv(stream: AsyncIterator[bytes]) -> AsyncIterator[Dict]:
+    header = None
+    record = ""
+    async for line in _lines(stream):
+        # A quoted field may span lines; a complete row has balanced quotes
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue
+        row, record = next(csv.reader([record]), None), ""
+        if not row:
+            continue
+        if header is None:
+            header = row
+            continue
+        values = dict(zip(header, row))
+        if "completed" in values:
+            values["completed"] = values["completed"] == "True"
+        yield {key: value if value != "" else None for key, value in values.items()}
+
+
+class _Importer:
+    def __init__(self, db, user_id: ObjectId):
+        self.db = db
+        self.user_id = user_id
+        self.ids: Dict[str, ObjectId] = {}
+        self.pending: Dict[str, List[Dict]] = {"goals": [], "habits": [], "todos": []}
+        self.counts = {"goals": 0, "habits": 0, "todos": 0, "skipped": 0}
+
+    def _date(self, value: Optional[str]) -> Optional[datetime]:
+        return datetime.fromisoformat(value).replace(tzinfo=None) if value else None
+
+    def _known(self, old_id: Optional[str]) -> Optional[ObjectId]:
+        return self.ids.get(old_id) if old_id else None
+
+    async def add(self, record: Dict):
+        kind = record.get("type")
+        new_id = ObjectId()
+        if kind == "goal":
+            self.ids[record["id"]] = new_id
+            doc = {
+                "_id": new_id,
+                "description": record["description"],
+                "user_id": self.user_id,
+                "completion_date": self._date(record.get("completion_date")),
+                "category": record.get("category") or "Other",
+                "status": record.get("status") or "in_progress",
+                **ZERO_COUNTS,
+            }
+            collection = "goals"
+        elif kind == "habit":
+            goal_id = self._known(record.get("goal_id"))
+            if goal_id is None:
+                self.counts["skipped"] += 1
+                return
+            self.ids[record["id"]] = new_id
+            doc = {
+                "_id": new_id,
+                "description": record["description"],
+                "frequency": record["frequency"],
+                "goal_id": goal_id,
+                **ZERO_COUNTS,
+                "streak": empty_streak(),
+            }
+            collection = "habits"
+        elif kind == "todo":
+            habit_id = self._known(record.get("habit_id"))
+            if record.get("habit_id") and habit_id is None:
+                self.counts["skipped"] += 1
+                return
+            doc = {
+                "_id": new_id,
+                "description": record["description"],
+                "completed": bool(record.get("completed")),
+                "due_date": self._date(record["due_date"]),
+                "user_id": self.user_id,
+                "habit_id": habit_id,
+                "goal_id": self._known(record.get("goal_id")),
+                "updated_at": now_ms(),
+            }
+            collection = "todos"
+        else:
+            raise ValueError(f"Unknown record type {kind!r}")
+
+        self.pending[collection].append(doc)
+        # Parents are flushed before children so references always exist
+        if len(self.pending[collection]) >= IMPORT_BATCH_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        for collection in ("goals", "habits", "todos"):
+            docs, self.pending[collection] = self.pending[collection], []
+            if not docs:
+                continue
+            try:
+                await self.db[collection].insert_many(docs, ordered=False)
+                self.counts[collection] += len(docs)
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                if any(error["code"] != DUPLICATE_KEY_ERROR for error in write_errors):
+                    raise
+                # A todo for the same habit and day already exists
+                self.counts[collection] += len(docs) - len(write_errors)
+                self.counts["skipped"] += len(write_errors)
+
+
+async def import_records(db, user_id: ObjectId, records: AsyncIterator[Dict]) -> Dict[str, int]:
+    """
+    Inserts exported records for `user_id` under new ids and rebuilds the
+    user's counters and streaks afterwards. Records whose parent is missing
+    are skipped. A malformed record stops the import with a 400 naming its
+    position; records before it are kept.
+    """
+    importer = _Importer(db, user_id)
+    position = 0
+    error = None
+    try:
+        async for record in records:
+            await importer.add(record)
+            position += 1
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        error = f"Invalid record {position + 1}: {e}"
+    await importer.flush()
+
+    await rebuild_counters(db, user_id)
+    await rebuild_streaks(db, user_id=user_id)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    return importer.counts
@@ -0,0 +1,205 @@
+import os
+import logging
+from typing import List, Dict, Optional, Tuple
+from datetime import date
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import OperationFailure
+from app.todo_service import build_todo, materialize_todos, start_of_day
+from app.counters import ZERO_COUNTS, day_key
+from app.purge import remove_habits, notify_purge
+from app.dashboard import empty_streak, apply_day
+
+logger = logging.getLogger(__name__)
+
+# auto: use a transaction when the deployment supports them (replica sets
+# and sharded clusters), otherwise write in order and clean up on failure
+MONGO_TRANSACTIONS = os.getenv("MONGO_TRANSACTIONS", "auto").lower()
+TRANSACTIONS_NOT_SUPPORTED = 20  # IllegalOperation on a standalone server
+
+_transactions_supported: Optional[bool] = {"true": True, "false": False}.get(MONGO_TRANSACTIONS)
+
+
+def build_habit(habit_data: Dict, goal_id: ObjectId) -> Dict:
+    return {
+        "_id": ObjectId(),
+        "description": habit_data["description"],
+        "frequency": habit_data["frequency"],
+        "goal_id": goal_id,
+        **ZERO_COUNTS,
+        "streak": empty_streak(),
+    }
+
+
+async def save_habit_plan(db, goal_id: ObjectId, user_id: ObjectId, habits_data: List[Dict]) -> List[Dict]:
+    """
+    Stores the habits of a generated plan for a goal and creates today's
+    todos for the daily ones. Returns the inserted habit documents.
+    """
+    habits = [build_habit(habit_data, goal_id) for habit_data in habits_data]
+    if not habits:
+        return []
+
+    await db.habits.insert_many(habits)
+
+    due_date = start_of_day(date.today())
+    await materialize_todos(
+        db,
+        [build_todo(habit, user_id, due_date) for habit in habits if habit["frequency"] == "daily"],
+        due_date,
+    )
+    return habits
+
+
+def build_goal_documents(goal_doc: Dict, habits_data: List[Dict]) -> Tuple[List[Dict], List[Dict], Optional[Dict]]:
+    """
+    Builds the habits, today's todos and the day rollup of a new goal with
+    their counters and streaks already set, so nothing has to be updated
+    after the insert. Assigns the goal's _id if it has none.
+    """
+    goal_id = goal_doc.setdefault("_id", ObjectId())
+    due_date = start_of_day(date.today())
+    habits = [build_habit(habit_data, goal_id) for habit_data in habits_data]
+    todos = [build_todo(habit, goal_doc["user_id"], due_date) for habit in habits if habit["frequency"] == "daily"]
+
+    for habit in habits:
+        if habit["frequency"] == "daily":
+            habit["todo_count"] = 1
+            apply_day(habit["streak"], due_date.date().toordinal(), True, False)
+    goal_doc["todo_count"] = len(todos)
+    goal_doc["completed_count"] = 0
+
+    rollup = None
+    if todos:
+        rollup = {"goal_id": goal_id, "day": day_key(todos[0]), "user_id": goal_doc["user_id"], "total": len(todos), "completed": 0}
+    return habits, todos, rollup
+
+
+async def _insert_goal(db, goal_doc: Dict, habits: List[Dict], todos: List[Dict], rollup: Optional[Dict], session=None):
+    # Children first: nothing reads them until the goal exists
+    if habits:
+        await db.habits.insert_many(habits, session=session)
+    if todos:
+        await db.todos.insert_many(todos, session=session)
+    if rollup:
+        await db.progress_days.insert_one(rollup, session=session)
+    await db.goals.insert_one(goal_doc, session=session)
+
+
+async def _remove_goal(db, goal_id: ObjectId):
+    await db.goals.delete_one({"_id": goal_id})
+    await db.todos.delete_many({"goal_id": goal_id})
+    await db.habits.delete_many({"goal_id": goal_id})
+    await db.progress_days.delete_many({"goal_id": goal_id})
+
+
+async def create_goal_with_plan(db, goal_doc: Dict, habits_data: List[Dict]) -> List[Dict]:
+    """
+    Writes a goal, its habits and today's todos in one transaction and
+    returns the habit documents, so the caller can respond without reading
+    anything back. Ids are assigned here, before anything is written.
+
+    Without transaction support the documents are written in order, goal
+    last, and whatever was written is removed again if a step fails.
+    """
+    global _transactions_supported
+    habits, todos, rollup = build_goal_documents(goal_doc, habits_data)
+
+    if _transactions_supported is not False:
+        try:
+            async with await db.client.start_session() as session:
+                # with_transaction retries on transient errors; the ids are
+                # fixed, so a retry writes the same documents
+                await session.with_transaction(
+                    lambda session: _insert_goal(db, goal_doc, habits, todos, rollup, session=session)
+                )
+            _transactions_supported = True
+            return habits
+        except OperationFailure as e:
+            if e.code != TRANSACTIONS_NOT_SUPPORTED or _transactions_supported:
+                raise
+            logger.info("MongoDB deployment does not support transactions, creating goals without them")
+            _transactions_supported = False
+
+    try:
+        await _insert_goal(db, goal_doc, habits, todos, rollup)
+    except Exception:
+        await _remove_goal(db, goal_doc["_id"])
+        raise
+    return habits
+
+
+def _habit_key(description: str) -> str:
+    return " ".join(description.casefold().split())
+
+
+def diff_habits(
+    existing: List[Dict], desired: List[Dict]
+) -> Tuple[List[Tuple[int, Dict]], List[Tuple[int, Dict, Dict]], List[Dict]]:
+    """
+    Matches the desired habits of a goal to its existing ones, first by id
+    and then by description (ignoring case and spacing). Returns the
+    (index in `desired`, habit data) pairs to insert, the (index, existing
+    habit, changed fields) triples to update and the habits to delete.
+    """
+    by_id = {str(habit["_id"]): habit for habit in existing}
+    matched: Dict[int, Dict] = {}
+    for index, habit_data in enumerate(desired):
+        habit = by_id.pop(str(habit_data.get("id")), None) if habit_data.get("id") else None
+        if habit is not None:
+            matched[index] = habit
+
+    by_key: Dict[str, List[Dict]] = {}
+    for habit in by_id.values():
+        by_key.setdefault(_habit_key(habit["description"]), []).append(habit)
+    for index, habit_data in enumerate(desired):
+        if index not in matched and by_key.get(_habit_key(habit_data["description"])):
+            matched[index] = by_key[_habit_key(habit_data["description"])].pop(0)
+
+    inserts, updates = [], []
+    for index, habit_data in enumerate(desired):
+        habit = matched.get(index)
+        if habit is None:
+            inserts.append((index, habit_data))
+            continue
+        changes = {
+            field: habit_data[field]
+            for field in ("description", "frequency")
+            if habit.get(field) != habit_data[field]
+        }
+        updates.append((index, habit, changes))
+
+    kept = {id(habit) for habit in matched.values()}
+    deletes = [habit for habit in existing if id(habit) not in kept]
+    return inserts, updates, deletes
+
+
+async def apply_habit_diff(db, goal_id: ObjectId, existing: List[Dict], desired: List[Dict]) -> List[Dict]:
+    """
+    Brings a goal's habits in line with `desired` with one bulk write.
+    Habits that are kept retain their id, todos, counters and streak; the
+    todos of removed habits are deleted and taken out of the goal's progress
+    by the purge worker. Returns the goal's habits after the change, in the
+    order of `desired`.
+    """
+    inserts, updates, deletes = diff_habits(existing, desired)
+
+    operations = []
+    habits: List[Optional[Dict]] = [None] * len(desired)
+    for index, habit, changes in updates:
+        if changes:
+            operations.append(UpdateOne({"_id": habit["_id"]}, {"$set": changes}))
+        habits[index] = {**habit, **changes}
+    for index, habit_data in inserts:
+        habit = build_habit(habit_data, goal_id)
+        operations.append(InsertOne(habit))
+        habits[index] = habit
+    if deletes:
+        await remove_habits(db, goal_id, [habit["_id"] for habit in deletes])
+        operations.extend(DeleteOne({"_id": habit["_id"]}) for habit in deletes)
+
+    if operations:
+        await db.habits.bulk_write(operations, ordered=False)
+    if deletes:
+        notify_purge()
+    return habits
@@ -0,0 +1,182 @@
+"""
+Indexes required by the queries in app/ and a query plan checker for them.
+
+Create the indexes (the app also does this on startup):
+
+    python -m app.indexes
+
+Explain every query shape and exit non-zero if any needs a collection scan:
+
+    python -m app.indexes --check
+"""
+import sys
+import asyncio
+import logging
+from typing import Dict, List
+from bson import ObjectId
+from datetime import datetime
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from app.todo_service import TOMBSTONE_TTL_DAYS
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True),
+        # The reminder scheduler walks users with reminders on in _id order
+        IndexModel([("reminders.enabled", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "goals": [
+        # Goal lists are filtered by owner and paged by _id
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)]),
+        # Only deleted goals waiting for the purge worker are indexed
+        IndexModel([("deleted_at", ASCENDING)], partialFilterExpression={"deleted_at": {"$type": "date"}}),
+    ],
+    "habits": [
+        IndexModel([("goal_id", ASCENDING), ("frequency", ASCENDING)]),
+        # The todo scheduler walks all daily habits in _id order
+        IndexModel([("frequency", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "todos": [
+        # One todo per habit per day; lets concurrent requests insert todos
+        # without checking first and treat duplicate key errors as "already there"
+        IndexModel(
+            [("habit_id", ASCENDING), ("due_date", ASCENDING)],
+            name="habit_id_due_date_unique",
+            unique=True,
+            partialFilterExpression={"habit_id": {"$type": "objectId"}},
+        ),
+        IndexModel([("user_id", ASCENDING), ("due_date", ASCENDING)]),
+        # The archiver picks todos past the retention window
+        IndexModel([("due_date", ASCENDING)]),
+        # Delta sync pages through a user's todos by last change
+        IndexModel([("user_id", ASCENDING), ("updated_at", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "todo_archive": [
+        IndexModel([("user_id", ASCENDING), ("month", ASCENDING)]),
+        IndexModel([("habit_ids", ASCENDING)]),
+    ],
+    "response_cache": [
+        # Only used with RESPONSE_CACHE_SHARED_BODIES
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "todo_tombstones": [
+        IndexModel([("user_id", ASCENDING), ("deleted_at", ASCENDING)]),
+        IndexModel([("deleted_at", ASCENDING)], expireAfterSeconds=TOMBSTONE_TTL_DAYS * 24 * 3600),
+    ],
+    "progress_days": [
+        IndexModel([("goal_id", ASCENDING), ("day", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("day", ASCENDING)]),
+    ],
+    "plan_jobs": [
+        IndexModel([("status", ASCENDING)]),
+    ],
+    "plan_cache": [
+        # Mongo drops cached plans once expires_at passes
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        IndexModel([("category", ASCENDING), ("tokens", ASCENDING)]),
+    ],
+}
+
+
+async def ensure_indexes(db):
+    """
+    Creates the declared indexes. Creating an index that already exists with
+    the same options is a no-op, so this is safe to run on every startup.
+    """
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection].create_indexes([index])
+            except OperationFailure as e:
+                logger.warning("Could not create index %s on %s: %s", index.document["name"], collection, e)
+
+
+def query_shapes() -> List[Dict]:
+    """
+    The filters (and sorts) issued by the API, with placeholder values.
+    """
+    oid = ObjectId()
+    today = datetime(2024, 1, 1)
+    return [
+        # app/auth.py and app/api/v1/auth.py
+        {"name": "user by email", "collection": "users", "filter": {"email": "user@example.com"}},
+        {"name": "user by id", "collection": "users", "filter": {"_id": oid}},
+        # app/api/v1/goals.py and app/progress.py
+        {"name": "goals page", "collection": "goals", "filter": {"user_id": oid, "_id": {"$gt": oid}}, "sort": {"_id": 1}},
+        {"name": "goal by owner", "collection": "goals", "filter": {"_id": oid, "user_id": oid}},
+        {"name": "habits of goal", "collection": "habits", "filter": {"goal_id": oid}},
+        {"name": "todos of habits", "collection": "todos", "filter": {"habit_id": {"$in": [oid]}}},
+        {"name": "plan job by owner", "collection": "plan_jobs", "filter": {"_id": oid, "user_id": oid}},
+        {"name": "plan cache entry", "collection": "plan_cache", "filter": {"_id": "key", "expires_at": {"$gt": today}}},
+        {"name": "similar cached plans", "collection": "plan_cache", "filter": {"category": "Other", "tokens": {"$in": ["read"]}, "expires_at": {"$gt": today}}},
+        # app/api/v1/todos.py and app/todo_service.py
+        {"name": "goal ids of user", "collection": "goals", "filter": {"user_id": oid}},
+        {"name": "daily habits of goals", "collection": "habits", "filter": {"goal_id": {"$in": [oid]}, "frequency": "daily"}},
+        {"name": "todos of habits on day", "collection": "todos", "filter": {"habit_id": {"$in": [oid]}, "due_date": {"$gte": today, "$lt": today}}},
+        {"name": "todo by owner", "collection": "todos", "filter": {"_id": oid, "user_id": oid}},
+        {"name": "todos of owner by id", "collection": "todos", "filter": {"_id": {"$in": [oid]}, "user_id": oid}},
+        {"name": "changed todos", "collection": "todos", "filter": {"user_id": oid, "$or": [{"updated_at": {"$gt": today}}, {"updated_at": today, "_id": {"$gt": oid}}]}, "sort": {"updated_at": 1, "_id": 1}},
+        {"name": "deleted todos", "collection": "todo_tombstones", "filter": {"user_id": oid, "deleted_at": {"$gte": today}}},
+        # app/scheduler.py and app/plan_jobs.py
+        {"name": "daily habits from checkpoint", "collection": "habits", "filter": {"frequency": "daily", "_id": {"$gt": oid}}, "sort": {"_id": 1}},
+        {"name": "deleted goals to purge", "collection": "goals", "filter": {"deleted_at": {"$ne": None}, "$or": [{"purge_locked_until": None}, {"purge_locked_until": {"$lt": today}}]}},
+        {"name": "todos to archive", "collection": "todos", "filter": {"due_date": {"$lt": today}, "habit_id": {"$type": "objectId"}}},
+        {"name": "archive of habits", "collection": "todo_archive", "filter": {"habit_ids": {"$in": [oid]}}},
+        {"name": "archive of user", "collection": "todo_archive", "filter": {"user_id": oid}, "sort": {"month": 1}},
+        {"name": "unfinished plan jobs", "collection": "plan_jobs", "filter": {"status": {"$in": ["pending", "running"]}}},
+        # app/reminders.py
+        {"name": "users to remind", "collection": "users", "filter": {"reminders.enabled": True, "_id": {"$gt": oid}}, "sort": {"_id": 1}},
+        {"name": "open todos of users on day", "collection": "todos", "filter": {"user_id": {"$in": [oid]}, "due_date": {"$gte": today, "$lt": today}, "completed": False}},
+    ]
+
+
+def _stages(plan) -> List[str]:
+    if isinstance(plan, dict):
+        found = [plan["stage"]] if "stage" in plan else []
+        for value in plan.values():
+            found += _stages(value)
+        return found
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in _stages(item)]
+    return []
+
+
+async def check_query_plans(db) -> List[str]:
+    """
+    Explains every query shape and returns the names of those whose winning
+    plan contains a collection scan.
+    """
+    failures = []
+    for shape in query_shapes():
+        command = {"find": shape["collection"], "filter": shape["filter"]}
+        if "sort" in shape:
+            command["sort"] = shape["sort"]
+        explain = await db.command("explain", command, verbosity="queryPlanner")
+        stages = _stages(explain["queryPlanner"]["winningPlan"])
+        scans = "COLLSCAN" in stages
+        print(f"{'FAIL' if scans else 'ok':<5} {shape['collection']:<12} {shape['name']:<30} {' > '.join(stages)}")
+        if scans:
+            failures.append(shape["name"])
+    return failures
+
+
+async def main(argv: List[str]) -> int:
+    from app.database import connect
+
+    database = connect()
+    await ensure_indexes(database)
+    if "--check" in argv:
+        failures = await check_query_plans(database)
+        if failures:
+            print(f"{len(failures)} query shape(s) fall back to a collection scan")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    sys.exit(asyncio.run(main(sys.argv[1:])))
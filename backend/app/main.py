@@ -1,11 +1,61 @@
+from app import startup
 from dotenv import load_dotenv
 
 load_dotenv()
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1.api import router as api_router
+from app import database as db_module
+from app.indexes import ensure_indexes
+from app import scheduler, plan_jobs, plan_cache, password_service, metrics, purge, archive, response_cache, ai_service, admission, notifications, reminders, events
 
-app = FastAPI(redirect_slashes=False)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with startup.phase("mongo_connect"):
+        database = db_module.connect()
+    with startup.phase("ensure_indexes"):
+        await ensure_indexes(database)
+    with startup.phase("workers"):
+        todo_scheduler = scheduler.TodoScheduler(database)
+        if scheduler.SCHEDULER_ENABLED:
+            todo_scheduler.start()
+        plan_jobs.job_queue = plan_jobs.PlanJobQueue(database)
+        await plan_jobs.job_queue.start()
+        purge.purge_worker = purge.GoalPurgeWorker(database)
+        purge.purge_worker.start()
+        archiver = archive.TodoArchiver(database)
+        if archive.ARCHIVE_ENABLED:
+            archiver.start()
+        notifications.dispatcher = notifications.NotificationDispatcher()
+        notifications.dispatcher.start()
+        reminder_scheduler = reminders.ReminderScheduler(database, notifications.dispatcher)
+        if reminders.REMINDERS_ENABLED:
+            reminder_scheduler.start()
+    with startup.phase("events"):
+        await events.start(database)
+    startup.ready()
+    # Load the OpenAI client once the worker is serving
+    warmup = None
+    if ai_service.AI_BACKEND == "openai" and ai_service.AI_CLIENT_WARMUP:
+        warmup = asyncio.create_task(ai_service.warm_up())
+    yield
+    if warmup is not None:
+        # The thread cannot be interrupted; let it finish so its client is closed
+        await warmup
+    await ai_service.close_client()
+    await events.stop()
+    await reminder_scheduler.stop()
+    await notifications.dispatcher.stop()
+    await archiver.stop()
+    await purge.purge_worker.stop()
+    await plan_jobs.job_queue.stop()
+    await todo_scheduler.stop()
+    db_module.close()
+
+app = FastAPI(redirect_slashes=False, lifespan=lifespan)
 
 # CORS Middleware
 app.add_middleware(
@@ -14,10 +64,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Retry-After"],
 )
 
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.include_router(api_router, prefix="/api/v1")
 
+metrics.register_gauges("todo_scheduler", lambda: scheduler.metrics)
+metrics.register_gauges("plan_cache", lambda: plan_cache.metrics)
+metrics.register_gauges("password_hashing", lambda: password_service.metrics)
+metrics.register_gauges("mongodb_pool", lambda: db_module.pool_metrics)
+metrics.register_gauges("goal_purge", lambda: purge.metrics)
+metrics.register_gauges("todo_archive", lambda: archive.metrics)
+metrics.register_gauges("response_cache", lambda: response_cache.metrics)
+metrics.register_gauges("startup", lambda: startup.metrics)
+metrics.register_gauges("admission", lambda: admission.metrics)
+metrics.register_gauges("notifications", lambda: notifications.metrics)
+metrics.register_gauges("reminders", lambda: reminders.metrics)
+metrics.register_gauges("events", lambda: events.metrics)
+
 @app.get("/api/v1/health")
 def read_root():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/api/v1/health/scheduler")
+def read_scheduler_metrics():
+    return scheduler.metrics
+
+@app.get("/api/v1/health/plan-cache")
+def read_plan_cache_metrics():
+    return plan_cache.metrics
+
+@app.get("/api/v1/health/db")
+def read_db_pool_metrics():
+    return db_module.pool_metrics
+
+@app.get("/api/v1/health/startup")
+def read_startup_metrics():
+    return startup.metrics
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+startup.imported()
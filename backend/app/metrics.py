@@ -0,0 +1,200 @@
+"""
+Request, database and LLM instrumentation, exposed in the Prometheus text
+format on GET /metrics.
+"""
+import time
+import threading
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+DOCUMENT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+_lock = threading.Lock()
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> (bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        with _lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self._values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {bucket_count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route", ("method", "route", "status"),
+)
+request_db_commands = Histogram(
+    "http_request_db_commands", "Mongo commands issued per request", ("method", "route"), COUNT_BUCKETS,
+)
+request_db_documents = Histogram(
+    "http_request_db_documents", "Mongo documents returned per request", ("method", "route"), DOCUMENT_BUCKETS,
+)
+db_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "Mongo command latency", ("command",),
+)
+db_command_failures = Counter(
+    "mongodb_command_failures_total", "Failed Mongo commands", ("command",),
+)
+llm_duration = Histogram(
+    "llm_request_duration_seconds", "Habit plan generation latency", ("backend", "outcome"),
+)
+
+registry: List = [request_duration, request_db_commands, request_db_documents, db_command_duration, db_command_failures, llm_duration]
+
+# Components that already keep a dict of counters register it here and have
+# its numeric values exported as gauges
+gauge_sources: List[Tuple[str, Callable[[], Dict]]] = []
+
+
+def register_gauges(prefix: str, source: Callable[[], Dict]):
+    gauge_sources.append((prefix, source))
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    for prefix, source in gauge_sources:
+        for key, value in source().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Mongo commands and documents seen while handling the current request.
+# Motor copies the context into its executor threads, so the command
+# listener updates the dict of the request that issued the command.
+request_stats: ContextVar[Optional[Dict]] = ContextVar("request_stats", default=None)
+
+
+def _returned_documents(reply) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if reply.get("value") is not None:
+        return 1
+    return 0
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    def started(self, event):
+        stats = request_stats.get()
+        if stats is not None:
+            with _lock:
+                stats["commands"] += 1
+
+    def succeeded(self, event):
+        db_command_duration.observe(event.duration_micros / 1e6, event.command_name)
+        stats = request_stats.get()
+        if stats is not None:
+            documents = _returned_documents(event.reply)
+            with _lock:
+                stats["documents"] += documents
+
+    def failed(self, event):
+        db_command_duration.observe(event.duration_micros / 1e6, event.command_name)
+        db_command_failures.inc(event.command_name)
+
+
+command_listener = CommandMetricsListener()
+
+
+class MetricsMiddleware:
+    """
+    Records latency, Mongo command count and returned documents per route.
+    Server-sent event streams stay open for as long as the client listens,
+    so they are left out of the latency histogram.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = {"commands": 0, "documents": 0}
+        token = request_stats.set(stats)
+        status_code = 500
+        streaming = False
+
+        async def send_with_status(message):
+            nonlocal status_code, streaming
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                streaming = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                )
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_stats.reset(token)
+            # The router stores the matched route in the scope; use its
+            # template so /goals/{goal_id} is one series, not one per id
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            if not streaming:
+                request_duration.observe(elapsed, method, path, str(status_code))
+            request_db_commands.observe(stats["commands"], method, path)
+            request_db_documents.observe(stats["documents"], method, path)
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, EmailStr, validator
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Literal
 from bson import ObjectId
 from enum import Enum
 
@@ -29,6 +29,10 @@ class PyObjectId(ObjectId):
         field_schema.update(type="string")
         return field_schema
 
+class ReminderSettings(BaseModel):
+    phone_number: str
+    enabled: bool = True
+
 class UserBase(BaseModel):
     email: EmailStr
 
@@ -73,6 +77,8 @@ class Goal(BaseModel):
     completion_date: Optional[datetime] = None
     status: str = "in_progress"
     category: Optional[GoalCategory] = GoalCategory.OTHER
+    plan_status: Optional[str] = None
+    plan_job_id: Optional[PyObjectId] = None
 
     class Config:
         allow_population_by_field_name = True
@@ -94,7 +100,22 @@ class GoalWithProgress(GoalWithHabits):
     progress: float
     status: str
 
+class ProgressDay(BaseModel):
+    day: str
+    total: int
+    completed: int
+
+class HabitStreak(Habit):
+    current_streak: int
+    longest_streak: int
+    completion_rate_30d: float
+
+class DashboardSummary(BaseModel):
+    completion_rate_30d: float
+    habits: list[HabitStreak]
+
 class HabitCreate(BaseModel):
+    id: Optional[str] = None # set to keep an existing habit and its history
     description: str
     frequency: str
 
@@ -117,8 +138,27 @@ class Todo(BaseModel):
     due_date: datetime
     user_id: PyObjectId = Field(...)
     habit_id: Optional[PyObjectId] = Field(None)
+    updated_at: Optional[datetime] = None
 
     class Config:
         allow_population_by_field_name = True
         arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
\ No newline at end of file
+        json_encoders = {ObjectId: str}
+class TodoBatchItem(BaseModel):
+    op: Literal["update", "delete"]
+    id: str
+    completed: Optional[bool] = None
+    client_updated_at: Optional[datetime] = None
+
+class TodoBatch(BaseModel):
+    items: list[TodoBatchItem]
+
+class TodoBatchResult(BaseModel):
+    id: str
+    status: str # "ok", "not_found", "stale", "conflict" or "invalid"
+
+class TodoChanges(BaseModel):
+    todos: list[Todo]
+    deleted: list[str]
+    cursor: Optional[str] = None
+    has_more: bool
@@ -0,0 +1,285 @@
+"""
+Outgoing notifications.
+
+Messages are dicts:
+
+    {"user_id": ..., "channel": "sms", "to": "+15550100", "body": "...",
+     "kind": "direct" | "reminder"}
+
+`submit` / `enqueue` put them on a bounded in-process queue that a pool of
+worker tasks drains in batches. Within a batch, reminders for the same
+recipient are merged into one message, and each channel's messages go to its
+provider in chunks of the provider's `max_batch`. Messages that fail are
+retried with exponential backoff up to NOTIFY_MAX_ATTEMPTS times; the queue
+lives in memory, so messages still queued when a worker stops are lost.
+
+Producers that must know a message went out can attach futures under
+"waiters". They get True once the provider accepted the message, False when
+it was given up on, and are cancelled if the dispatcher stops first.
+
+Providers are looked up by name in `providers`, and more can be added with
+`register_provider`. NOTIFY_SMS_PROVIDER picks the one used for SMS:
+
+- log (default): logs every message.
+- file: appends one JSON line per message to NOTIFY_FILE_PATH.
+"""
+import os
+import random
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+from app.serialization import to_json
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "10000"))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "200"))
+# How long a worker waits for more messages before sending a partial batch
+NOTIFY_BATCH_WAIT_SECONDS = float(os.getenv("NOTIFY_BATCH_WAIT_SECONDS", "0.05"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+NOTIFY_BACKOFF_SECONDS = float(os.getenv("NOTIFY_BACKOFF_SECONDS", "2"))
+# How long stop() lets the workers empty the queue
+NOTIFY_DRAIN_SECONDS = float(os.getenv("NOTIFY_DRAIN_SECONDS", "10"))
+NOTIFY_SMS_PROVIDER = os.getenv("NOTIFY_SMS_PROVIDER", "log")
+NOTIFY_FILE_PATH = os.getenv("NOTIFY_FILE_PATH", "notifications.ndjson")
+
+metrics: Dict = {
+    "queued": 0,
+    "sent": 0,
+    "coalesced": 0,
+    "retried": 0,
+    "failed": 0,
+    "rejected": 0,
+    "batches": 0,
+    "queue_size": 0,
+    "last_error": None,
+}
+
+
+class PermanentNotificationError(Exception):
+    """
+    Returned or raised by a provider for messages that must not be retried,
+    e.g. an invalid number.
+    """
+
+
+class LogProvider:
+    max_batch = 1000
+
+    async def send(self, messages: List[Dict]) -> List[Optional[Exception]]:
+        for message in messages:
+            logger.info("%s to %s: %s", message["channel"].upper(), message["to"], message["body"])
+        return [None] * len(messages)
+
+
+class FileProvider:
+    """
+    Appends messages to a file, for local development and tests.
+    """
+    max_batch = 1000
+
+    def __init__(self, path: str = NOTIFY_FILE_PATH):
+        self.path = path
+
+    def _write(self, lines: bytes):
+        with open(self.path, "ab") as f:
+            f.write(lines)
+
+    async def send(self, messages: List[Dict]) -> List[Optional[Exception]]:
+        sent_at = datetime.utcnow()
+        lines = b"".join(to_json({**message, "sent_at": sent_at}) + b"\n" for message in messages)
+        await asyncio.to_thread(self._write, lines)
+        return [None] * len(messages)
+
+
+providers: Dict[str, object] = {
+    "log": LogProvider(),
+    "file": FileProvider(),
+}
+
+channel_providers: Dict[str, str] = {
+    "sms": NOTIFY_SMS_PROVIDER,
+}
+
+
+def register_provider(name: str, provider):
+    """
+    Adds a provider: an object with a `max_batch` attribute and an async
+    `send(messages)` that returns one error or None per message.
+    """
+    providers[name] = provider
+
+
+def coalesce(messages: List[Dict]) -> List[Dict]:
+    """
+    Merges the reminders to the same recipient on the same channel into one
+    message. Other messages are kept as they are.
+    """
+    merged: Dict[tuple, Dict] = {}
+    out = []
+    for message in messages:
+        if message.get("kind") != "reminder":
+            out.append(message)
+            continue
+        key = (message["channel"], message["to"])
+        if key in merged:
+            first = merged[key]
+            first["body"] += "\n" + message["body"]
+            if "waiters" in message:
+                first["waiters"] = first.get("waiters", []) + message["waiters"]
+            if "attempts" in first:
+                first["attempts"] = min(first["attempts"], message.get("attempts", 0))
+            metrics["coalesced"] += 1
+        else:
+            merged[key] = dict(message)
+            out.append(merged[key])
+    return out
+
+
+def settle(message: Dict, sent: bool):
+    for waiter in message.get("waiters", ()):
+        if not waiter.done():
+            waiter.set_result(sent)
+
+
+def outgoing(message: Dict) -> Dict:
+    """
+    The message as providers see it, without its waiters.
+    """
+    if "waiters" not in message:
+        return message
+    return {key: value for key, value in message.items() if key != "waiters"}
+
+
+class NotificationDispatcher:
+    """
+    Sends queued notifications with a pool of worker tasks.
+    """
+
+    def __init__(self, workers: int = NOTIFY_WORKERS, queue_size: int = NOTIFY_QUEUE_SIZE):
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self._retries: set = set()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain: float = NOTIFY_DRAIN_SECONDS):
+        try:
+            await asyncio.wait_for(self.queue.join(), drain)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping with %d notifications still queued", self.queue.qsize())
+        for task in [*self._tasks, *self._retries]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retries, return_exceptions=True)
+        self._tasks = []
+        self._retries = set()
+        while not self.queue.empty():
+            for waiter in self.queue.get_nowait().get("waiters", ()):
+                waiter.cancel()
+
+    def submit(self, message: Dict) -> bool:
+        """
+        Queues a message without waiting. Returns False when the queue is full.
+        """
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            metrics["rejected"] += 1
+            return False
+        metrics["queued"] += 1
+        metrics["queue_size"] = self.queue.qsize()
+        return True
+
+    async def enqueue(self, message: Dict):
+        """
+        Queues a message, waiting while the queue is full. For background
+        producers that should slow down rather than drop messages.
+        """
+        await self.queue.put(message)
+        metrics["queued"] += 1
+        metrics["queue_size"] = self.queue.qsize()
+
+    async def _next_batch(self) -> List[Dict]:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + NOTIFY_BATCH_WAIT_SECONDS
+        while len(batch) < NOTIFY_BATCH_SIZE:
+            if self.queue.empty():
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            messages = coalesce(batch)
+            try:
+                await self._send(messages)
+            except Exception as e:
+                metrics["last_error"] = str(e)
+                logger.exception("Sending notifications failed")
+                for message in messages:
+                    settle(message, False)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+                metrics["queue_size"] = self.queue.qsize()
+
+    async def _send(self, messages: List[Dict]):
+        by_channel: Dict[str, List[Dict]] = {}
+        for message in messages:
+            by_channel.setdefault(message["channel"], []).append(message)
+
+        for channel, pending in by_channel.items():
+            provider = providers[channel_providers[channel]]
+            for i in range(0, len(pending), provider.max_batch):
+                chunk = pending[i:i + provider.max_batch]
+                try:
+                    errors = await provider.send([outgoing(message) for message in chunk])
+                except Exception as e:
+                    errors = [e] * len(chunk)
+                metrics["batches"] += 1
+                for message, error in zip(chunk, errors):
+                    if error is None:
+                        metrics["sent"] += 1
+                        settle(message, True)
+                    else:
+                        self._failed(message, error)
+
+    def _failed(self, message: Dict, error: Exception):
+        attempts = message.get("attempts", 0) + 1
+        if isinstance(error, PermanentNotificationError) or attempts >= NOTIFY_MAX_ATTEMPTS:
+            metrics["failed"] += 1
+            metrics["last_error"] = str(error)
+            logger.warning("Giving up on %s notification to %s: %s", message["channel"], message["to"], error)
+            settle(message, False)
+            return
+        metrics["retried"] += 1
+        delay = NOTIFY_BACKOFF_SECONDS * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+        task = asyncio.create_task(self._retry({**message, "attempts": attempts}, delay))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _retry(self, message: Dict, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            await self.enqueue(message)
+        except asyncio.CancelledError:
+            for waiter in message.get("waiters", ()):
+                waiter.cancel()
+            raise
+
+
+# Set up by the app lifespan
+dispatcher: Optional[NotificationDispatcher] = None
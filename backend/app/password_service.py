@@ -0,0 +1,84 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, status
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Hash and verify calls allowed to wait for a worker before new ones are
+# turned away with a 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = 1
+
+_pwd_context = None
+
+
+def get_pwd_context():
+    """
+    Builds the passlib context on first use, keeping passlib and bcrypt out
+    of the import of the app.
+    """
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+
+        # Pinning min and max rounds to the configured cost makes passlib
+        # flag every hash made with another cost as needing an update
+        _pwd_context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=BCRYPT_ROUNDS,
+            bcrypt__min_rounds=BCRYPT_ROUNDS,
+            bcrypt__max_rounds=BCRYPT_ROUNDS,
+        )
+    return _pwd_context
+
+# bcrypt releases the GIL while hashing, so threads give real parallelism
+executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+
+metrics: Dict = {
+    "hashed": 0,
+    "verified": 0,
+    "rehashed": 0,
+    "rejected": 0,
+    "pending": 0,
+}
+
+
+async def _run(func, *args):
+    global _pending
+    if _pending >= PASSWORD_HASH_MAX_PENDING:
+        metrics["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, please retry",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+        )
+
+    _pending += 1
+    metrics["pending"] = _pending
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    finally:
+        _pending -= 1
+        metrics["pending"] = _pending
+
+
+async def hash_password(password: str) -> str:
+    hashed = await _run(get_pwd_context().hash, password)
+    metrics["hashed"] += 1
+    return hashed
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Checks a password off the event loop. On success also returns a new hash
+    when the stored one was made with a different cost, else None.
+    """
+    valid, new_hash = await _run(get_pwd_context().verify_and_update, plain_password, hashed_password)
+    metrics["verified"] += 1
+    if new_hash:
+        metrics["rehashed"] += 1
+    return valid, new_hash
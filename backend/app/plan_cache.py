@@ -0,0 +1,116 @@
+import os
+import re
+import hashlib
+from typing import List, Dict, Optional
+from datetime import datetime, timedelta
+from app.ai_service import generate_habit_plan
+from app.cache import LRUCache
+
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "1024"))
+PLAN_CACHE_TTL_SECONDS = int(os.getenv("PLAN_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Jaccard similarity between token sets above which a cached plan is reused
+# for a differently worded goal. 0 turns fuzzy lookups off.
+PLAN_CACHE_FUZZY_THRESHOLD = float(os.getenv("PLAN_CACHE_FUZZY_THRESHOLD", "0"))
+FUZZY_CANDIDATES = 50
+
+STOPWORDS = {
+    "a", "an", "the", "to", "and", "or", "of", "for", "in", "on", "at", "my",
+    "i", "want", "would", "like", "be", "more", "every", "each", "per", "day", "daily",
+}
+
+metrics: Dict = {
+    "memory_hits": 0,
+    "shared_hits": 0,
+    "fuzzy_hits": 0,
+    "misses": 0,
+}
+
+
+def normalize(description: str) -> List[str]:
+    words = re.sub(r"[^a-z0-9]+", " ", description.lower()).split()
+    tokens = [word for word in words if word not in STOPWORDS]
+    # A goal made only of stopwords still needs a key
+    return tokens or words
+
+
+def cache_key(tokens: List[str], category: Optional[str]) -> str:
+    raw = f"{category or ''}|{' '.join(tokens)}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def similarity(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+memory_cache = LRUCache(PLAN_CACHE_SIZE, PLAN_CACHE_TTL_SECONDS)
+
+
+async def _lookup(db, key: str, tokens: List[str], category: Optional[str]) -> Optional[List[Dict]]:
+    entry = memory_cache.get(key)
+    if entry is not None:
+        metrics["memory_hits"] += 1
+        return entry["habits"]
+
+    entry = await db.plan_cache.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+    if entry is not None:
+        metrics["shared_hits"] += 1
+        memory_cache.set(key, entry)
+        return entry["habits"]
+
+    if PLAN_CACHE_FUZZY_THRESHOLD > 0:
+        entry = await _fuzzy_lookup(db, tokens, category)
+        if entry is not None:
+            metrics["fuzzy_hits"] += 1
+            memory_cache.set(key, entry)
+            return entry["habits"]
+
+    return None
+
+
+async def _fuzzy_lookup(db, tokens: List[str], category: Optional[str]) -> Optional[Dict]:
+    wanted = set(tokens)
+    candidates = [entry for entry in memory_cache.values() if entry["category"] == category]
+    candidates += await db.plan_cache.find(
+        {"category": category, "tokens": {"$in": tokens}, "expires_at": {"$gt": datetime.utcnow()}}
+    ).limit(FUZZY_CANDIDATES).to_list(length=FUZZY_CANDIDATES)
+
+    best, best_score = None, PLAN_CACHE_FUZZY_THRESHOLD
+    for entry in candidates:
+        score = similarity(wanted, set(entry["tokens"]))
+        if score >= best_score:
+            best, best_score = entry, score
+    return best
+
+
+async def get_habit_plan(db, goal_description: str, category: Optional[str] = None) -> List[Dict]:
+    """
+    Returns a habit plan for the goal, generating it only when no plan for an
+    equivalent goal is cached in process or in the shared `plan_cache`
+    collection.
+    """
+    tokens = normalize(goal_description)
+    key = cache_key(tokens, category)
+
+    habits = await _lookup(db, key, tokens, category)
+    if habits is not None:
+        return habits
+
+    metrics["misses"] += 1
+    habits = await generate_habit_plan(goal_description)
+    if not habits:
+        return habits
+
+    now = datetime.utcnow()
+    entry = {
+        "_id": key,
+        "tokens": tokens,
+        "category": category,
+        "habits": habits,
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=PLAN_CACHE_TTL_SECONDS),
+    }
+    memory_cache.set(key, entry)
+    await db.plan_cache.replace_one({"_id": key}, entry, upsert=True)
+    return habits
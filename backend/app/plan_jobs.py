@@ -0,0 +1,139 @@
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+from datetime import datetime, timedelta
+from bson import ObjectId
+from app.plan_cache import get_habit_plan
+from app.goal_service import save_habit_plan
+from app.purge import NOT_DELETED
+from app import response_cache, events
+
+logger = logging.getLogger(__name__)
+
+PLAN_WORKERS = int(os.getenv("AI_PLAN_WORKERS", "2"))
+# A running job not finished after this long is taken as abandoned by its
+# worker and run again; keep it above the LLM timeout with retries
+PLAN_JOB_LEASE_SECONDS = int(os.getenv("AI_PLAN_JOB_LEASE_SECONDS", "300"))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class PlanJobQueue:
+    """
+    Generates habit plans in the background so goal creation can return
+    before the LLM answers.
+
+    Jobs are stored in the `plan_jobs` collection and their ids are handed to
+    a small pool of worker tasks through an in-process queue. A worker only
+    runs a job it claims, moving it from pending to running, so instances
+    that queued the same job do not both run it. Pending jobs and running
+    ones older than PLAN_JOB_LEASE_SECONDS, left behind by a worker that
+    stopped, are queued again on start and every PLAN_JOB_LEASE_SECONDS,
+    unless they are still waiting in the queue.
+    """
+
+    def __init__(self, db, workers: int = PLAN_WORKERS):
+        self.db = db
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._queued: Set[ObjectId] = set()
+        self._tasks: List[asyncio.Task] = []
+
+    def _claimable(self) -> Dict:
+        expired = datetime.utcnow() - timedelta(seconds=PLAN_JOB_LEASE_SECONDS)
+        return {"$or": [{"status": PENDING}, {"status": RUNNING, "started_at": {"$lt": expired}}]}
+
+    def _enqueue(self, job_id: ObjectId):
+        if job_id not in self._queued:
+            self._queued.add(job_id)
+            self.queue.put_nowait(job_id)
+
+    async def _requeue(self):
+        async for job in self.db.plan_jobs.find(self._claimable(), {"_id": 1}):
+            self._enqueue(job["_id"])
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(PLAN_JOB_LEASE_SECONDS)
+            try:
+                await self._requeue()
+            except Exception:
+                logger.exception("Requeueing plan jobs failed")
+
+    async def start(self):
+        await self._requeue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, goal_id: ObjectId, user_id: ObjectId, description: str, category: Optional[str] = None, job_id: Optional[ObjectId] = None) -> ObjectId:
+        job_id = job_id or ObjectId()
+        await self.db.plan_jobs.insert_one({
+            "_id": job_id,
+            "goal_id": goal_id,
+            "user_id": user_id,
+            "description": description,
+            "category": category,
+            "status": PENDING,
+            "created_at": datetime.utcnow(),
+        })
+        self._enqueue(job_id)
+        return job_id
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.exception("Plan job %s failed", job_id)
+                await self._finish(job_id, FAILED, error=str(e))
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job_id: ObjectId):
+        job = await self.db.plan_jobs.find_one_and_update(
+            {"_id": job_id, **self._claimable()},
+            {"$set": {"status": RUNNING, "started_at": datetime.utcnow()}},
+        )
+        if job is None:
+            return
+
+        habits_data = await get_habit_plan(self.db, job["description"], job.get("category"))
+        if not habits_data:
+            await self._finish(job_id, FAILED, error="Failed to generate habit plan")
+            return
+
+        if not await self.db.goals.find_one({"_id": job["goal_id"], **NOT_DELETED}, {"_id": 1}):
+            await self._finish(job_id, FAILED, error="Goal was deleted")
+            return
+
+        # A restarted job may have saved its habits before it was interrupted
+        if not await self.db.habits.find_one({"goal_id": job["goal_id"]}, {"_id": 1}):
+            await save_habit_plan(self.db, job["goal_id"], job["user_id"], habits_data)
+        await self._finish(job_id, DONE)
+
+    async def _finish(self, job_id: ObjectId, status: str, error: Optional[str] = None):
+        update = {"status": status, "finished_at": datetime.utcnow()}
+        if error:
+            update["error"] = error
+        job = await self.db.plan_jobs.find_one_and_update({"_id": job_id}, {"$set": update})
+        if job is not None:
+            await self.db.goals.update_one({"_id": job["goal_id"]}, {"$set": {"plan_status": status}})
+            await response_cache.bump(job["user_id"])
+            events.emit(job["user_id"], {"type": "changed", "scope": "goals"})
+            events.emit(job["user_id"], {"type": "changed", "scope": "todos"})
+
+
+# Set up by the app lifespan
+job_queue: Optional[PlanJobQueue] = None
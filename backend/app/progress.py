@@ -0,0 +1,81 @@
+from typing import List, Dict, Optional
+from bson import ObjectId
+from app.purge import NOT_DELETED
+from app.archive import archived_counts
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 100
+
+
+def goals_with_progress_pipeline(user_id: ObjectId, after: Optional[ObjectId] = None, limit: int = DEFAULT_PAGE_SIZE) -> List[Dict]:
+    """
+    Builds a single aggregation that returns a page of a user's goals together
+    with their habits. Progress comes from the counters kept on each goal
+    (see app/counters.py), so todos are not read at all.
+    """
+    match = {"user_id": user_id, **NOT_DELETED}
+    if after is not None:
+        match["_id"] = {"$gt": after}
+
+    return [
+        {"$match": match},
+        {"$sort": {"_id": 1}},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": "habits",
+            "localField": "_id",
+            "foreignField": "goal_id",
+            "as": "habits",
+        }},
+    ]
+
+
+def todo_counts_pipeline(habit_ids: List[ObjectId]) -> List[Dict]:
+    """
+    Counts todos per habit on the server, for goals whose counters have not
+    been built yet.
+    """
+    return [
+        {"$match": {"habit_id": {"$in": habit_ids}}},
+        {"$group": {
+            "_id": "$habit_id",
+            "total": {"$sum": 1},
+            "completed": {"$sum": {"$cond": ["$completed", 1, 0]}},
+        }},
+    ]
+
+
+def progress_from_counts(total: int, completed: int) -> float:
+    return (completed / total) * 100 if total > 0 else 0
+
+
+async def fetch_goals_with_progress(db, user_id: ObjectId, after: Optional[ObjectId] = None, limit: int = DEFAULT_PAGE_SIZE) -> List[Dict]:
+    """
+    Returns goal documents with their habits and a computed `progress` field,
+    ordered by id, starting after the `after` cursor.
+    """
+    pipeline = goals_with_progress_pipeline(user_id, after=after, limit=limit)
+    goals = await db.goals.aggregate(pipeline).to_list(length=limit)
+
+    # Goals created before counters existed are counted from their todos
+    # until `python -m app.counters` has backfilled them
+    uncounted = [goal for goal in goals if "todo_count" not in goal]
+    habit_ids = [habit["_id"] for goal in uncounted for habit in goal["habits"]]
+    if habit_ids:
+        rows = await db.todos.aggregate(todo_counts_pipeline(habit_ids)).to_list(length=None)
+        per_habit = {row["_id"]: row for row in rows}
+        # Add the days that were moved to the archive
+        for habit_id, (total, completed) in (await archived_counts(db, habit_ids)).items():
+            row = per_habit.setdefault(habit_id, {"total": 0, "completed": 0})
+            row["total"] += total
+            row["completed"] += completed
+        for goal in uncounted:
+            rows = [per_habit[habit["_id"]] for habit in goal["habits"] if habit["_id"] in per_habit]
+            goal["todo_count"] = sum(row["total"] for row in rows)
+            goal["completed_count"] = sum(row["completed"] for row in rows)
+
+    for goal in goals:
+        goal["progress"] = progress_from_counts(goal.get("todo_count", 0), goal.get("completed_count", 0))
+        goal["status"] = goal.get("status", "in_progress")
+
+    return goals
@@ -0,0 +1,292 @@
+"""
+Cascading deletes of goals.
+
+Deleting a goal only sets its `deleted_at`, so the API answers at once;
+every read of goals filters on NOT_DELETED. A background worker then removes
+the goal's todos in bounded batches (leaving tombstones for sync clients),
+followed by its habits, day rollups and finally the goal itself. Goals are
+claimed with a lease, so several app instances can run the worker.
+
+Habits dropped from a goal's plan are queued on the goal's
+`removed_habit_ids` and handled by the same worker: their todos are deleted
+in batches that each take their own counts out of the goal's progress, and
+their archived days are forgotten.
+
+Todos left behind by goals and habits deleted before this existed can be
+cleaned up with:
+
+    python -m app.purge --orphans
+"""
+import os
+import sys
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import DeleteOne, ReturnDocument
+from app.todo_service import delete_tombstones, now_ms
+from app.archive import forget_archived_habits
+from app.counters import apply_todo_deltas, forget_archived_counts
+from app import response_cache, events
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = int(os.getenv("GOAL_PURGE_BATCH_SIZE", "1000"))
+# Pause between batches so a large purge does not starve the API
+PURGE_BATCH_PAUSE_SECONDS = float(os.getenv("GOAL_PURGE_BATCH_PAUSE_SECONDS", "0.05"))
+PURGE_INTERVAL_SECONDS = int(os.getenv("GOAL_PURGE_INTERVAL_SECONDS", "60"))
+PURGE_LEASE_SECONDS = int(os.getenv("GOAL_PURGE_LEASE_SECONDS", "120"))
+
+NOT_DELETED = {"deleted_at": None}
+
+metrics: Dict = {
+    "goals_purged": 0,
+    "todos_purged": 0,
+    "orphan_todos_purged": 0,
+    "habits_purged": 0,
+    "errors": 0,
+    "last_error": None,
+}
+
+
+async def delete_in_batches(db, query: Dict, pause: float = PURGE_BATCH_PAUSE_SECONDS, counted: bool = False) -> int:
+    """
+    Deletes the todos matching `query` PURGE_BATCH_SIZE at a time and leaves
+    a tombstone for each. Returns how many were deleted.
+
+    With `counted`, each batch also takes its todos out of the progress
+    counters. A todo is then only deleted while it is unchanged since it was
+    read, so a concurrent toggle is counted out with its new state on the
+    next pass rather than with the old one.
+    """
+    deleted = 0
+    projection = {"user_id": 1}
+    if counted:
+        projection.update({"habit_id": 1, "goal_id": 1, "due_date": 1, "completed": 1, "updated_at": 1})
+    while True:
+        todos = await db.todos.find(query, projection).limit(PURGE_BATCH_SIZE).to_list(length=PURGE_BATCH_SIZE)
+        if not todos:
+            return deleted
+        ids = [todo["_id"] for todo in todos]
+        if counted:
+            result = await db.todos.bulk_write(
+                [DeleteOne({"_id": todo["_id"], "updated_at": todo.get("updated_at")}) for todo in todos],
+                ordered=False,
+            )
+            if result.deleted_count < len(todos):
+                remaining = set(await db.todos.distinct("_id", {"_id": {"$in": ids}}))
+                todos = [todo for todo in todos if todo["_id"] not in remaining]
+            await apply_todo_deltas(db, [(todo, -1, -1 if todo.get("completed") else 0) for todo in todos])
+        else:
+            result = await db.todos.delete_many({"_id": {"$in": ids}})
+        await delete_tombstones(db, todos, now_ms())
+        deleted += result.deleted_count
+        if pause:
+            await asyncio.sleep(pause)
+
+
+async def purge_goal(db, goal_id: ObjectId) -> int:
+    """
+    Removes a deleted goal and everything that belongs to it. Safe to run
+    again after an interruption. Returns the number of todos removed.
+    """
+    habit_ids = await db.habits.distinct("_id", {"goal_id": goal_id})
+    deleted = 0
+    if habit_ids:
+        deleted = await delete_in_batches(db, {"habit_id": {"$in": habit_ids}})
+        await forget_archived_habits(db, habit_ids)
+    await db.habits.delete_many({"goal_id": goal_id})
+    await db.progress_days.delete_many({"goal_id": goal_id})
+    await db.goals.delete_one({"_id": goal_id, "deleted_at": {"$ne": None}})
+    metrics["goals_purged"] += 1
+    metrics["todos_purged"] += deleted
+    return deleted
+
+
+async def purge_removed_habits(db, goal: Dict) -> int:
+    """
+    Removes the todos and archived days of the habits queued on a goal's
+    `removed_habit_ids`, taking them out of its progress. Safe to run again
+    after an interruption. Returns the number of todos removed.
+    """
+    queued = goal.get("removed_habit_ids", [])
+    # A habit whose delete failed is still part of the goal
+    habit_ids = await _missing(db.habits, queued)
+    deleted = 0
+    if habit_ids:
+        deleted = await delete_in_batches(db, {"habit_id": {"$in": habit_ids}}, counted=True)
+        await forget_archived_counts(db, goal["_id"], habit_ids)
+        await forget_archived_habits(db, habit_ids)
+    await db.goals.update_one(
+        {"_id": goal["_id"]},
+        {"$pullAll": {"removed_habit_ids": queued}, "$unset": {"purge_locked_by": "", "purge_locked_until": ""}},
+    )
+    if deleted:
+        await response_cache.bump(goal["user_id"])
+        events.emit(goal["user_id"], {"type": "changed", "scope": "todos"})
+    metrics["habits_purged"] += len(habit_ids)
+    metrics["todos_purged"] += deleted
+    return deleted
+
+
+class GoalPurgeWorker:
+    """
+    Purges deleted goals and removed habits in the background. notify()
+    wakes it up right after a delete; otherwise it polls every
+    PURGE_INTERVAL_SECONDS, which also picks up purges that were interrupted.
+    """
+
+    def __init__(self, db, worker_id: Optional[str] = None):
+        self.db = db
+        self.worker_id = worker_id or f"{os.uname().nodename}:{os.getpid()}"
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        self._wake.set()
+
+    async def _loop(self):
+        while True:
+            self._wake.clear()
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics["errors"] += 1
+                metrics["last_error"] = str(e)
+                logger.exception("Goal purge failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), PURGE_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self) -> Optional[Dict]:
+        now = datetime.utcnow()
+        return await self.db.goals.find_one_and_update(
+            {
+                "$and": [
+                    {"$or": [{"deleted_at": {"$ne": None}}, {"removed_habit_ids.0": {"$exists": True}}]},
+                    {"$or": [{"purge_locked_until": None}, {"purge_locked_until": {"$lt": now}}]},
+                ],
+            },
+            {"$set": {"purge_locked_by": self.worker_id, "purge_locked_until": now + timedelta(seconds=PURGE_LEASE_SECONDS)}},
+            projection={"user_id": 1, "deleted_at": 1, "removed_habit_ids": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def run(self) -> int:
+        """
+        Purges deleted goals and removed habits until none are left
+        unclaimed. Returns how many goals this worker purged.
+        """
+        purged = 0
+        while True:
+            goal = await self._claim()
+            if goal is None:
+                return purged
+            if goal.get("deleted_at") is not None:
+                await purge_goal(self.db, goal["_id"])
+                purged += 1
+            else:
+                await purge_removed_habits(self.db, goal)
+
+
+purge_worker: Optional[GoalPurgeWorker] = None
+
+
+async def soft_delete_goal(db, goal_id: ObjectId, user_id: ObjectId) -> bool:
+    result = await db.goals.update_one(
+        {"_id": goal_id, "user_id": user_id, **NOT_DELETED},
+        {"$set": {"deleted_at": datetime.utcnow()}},
+    )
+    if result.modified_count and purge_worker is not None:
+        purge_worker.notify()
+    return bool(result.modified_count)
+
+
+async def remove_habits(db, goal_id: ObjectId, habit_ids: List[ObjectId]):
+    """
+    Queues the todos of habits that are being deleted from a goal for the
+    purge worker. Call before deleting the habits.
+    """
+    if habit_ids:
+        await db.goals.update_one({"_id": goal_id}, {"$addToSet": {"removed_habit_ids": {"$each": habit_ids}}})
+
+
+def notify_purge():
+    if purge_worker is not None:
+        purge_worker.notify()
+
+
+async def _missing(collection, ids: List[ObjectId]) -> List[ObjectId]:
+    found = set(await collection.distinct("_id", {"_id": {"$in": ids}}))
+    return [_id for _id in ids if _id not in found]
+
+
+async def purge_orphans(db) -> int:
+    """
+    Deletes todos whose habit no longer exists and day rollups whose goal no
+    longer exists. Returns the number of todos removed.
+    """
+    deleted = 0
+    habit_ids = db.todos.aggregate([
+        {"$match": {"habit_id": {"$type": "objectId"}}},
+        {"$group": {"_id": "$habit_id"}},
+    ], allowDiskUse=True)
+    chunk = []
+    async for row in habit_ids:
+        chunk.append(row["_id"])
+        if len(chunk) >= PURGE_BATCH_SIZE:
+            orphaned = await _missing(db.habits, chunk)
+            if orphaned:
+                deleted += await delete_in_batches(db, {"habit_id": {"$in": orphaned}})
+            chunk = []
+    if chunk:
+        orphaned = await _missing(db.habits, chunk)
+        if orphaned:
+            deleted += await delete_in_batches(db, {"habit_id": {"$in": orphaned}})
+
+    goal_ids = await db.progress_days.distinct("goal_id")
+    for i in range(0, len(goal_ids), PURGE_BATCH_SIZE):
+        orphaned = await _missing(db.goals, goal_ids[i:i + PURGE_BATCH_SIZE])
+        if orphaned:
+            await db.progress_days.delete_many({"goal_id": {"$in": orphaned}})
+
+    metrics["orphan_todos_purged"] += deleted
+    logger.info("Removed %d orphaned todos", deleted)
+    return deleted
+
+
+async def main(argv: List[str]) -> int:
+    from app.database import connect
+
+    db = connect()
+    if "--orphans" in argv:
+        await purge_orphans(db)
+    else:
+        purged = await GoalPurgeWorker(db).run()
+        logger.info("Purged %d deleted goals", purged)
+    return 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main(sys.argv[1:])))
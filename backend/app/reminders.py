@@ -0,0 +1,226 @@
+"""
+Daily habit reminders.
+
+Once a day, after REMINDER_HOUR (server local time), every user who turned
+reminders on gets one SMS listing the todos due that day they have not
+completed yet. Users are walked in _id order REMINDER_BATCH_SIZE at a time,
+with one todos query per batch, and the messages are handed to the
+notification dispatcher. Progress is checkpointed per day like the todo
+scheduler's, but only once the provider has taken a batch's messages, so a
+worker restarted mid-batch sends that batch again rather than dropping it.
+The lease is renewed while a batch is being sent, and a worker that lost it
+stops instead of sending the same users a second reminder.
+
+Send today's reminders right away with:
+
+    python -m app.reminders
+"""
+import os
+import sys
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from app.scheduler import acquire_checkpoint, LEASE_SECONDS
+from app.todo_service import start_of_day
+from app import notifications
+
+logger = logging.getLogger(__name__)
+
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "true").lower() == "true"
+REMINDER_HOUR = int(os.getenv("REMINDER_HOUR", "8"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+REMINDER_INTERVAL_SECONDS = int(os.getenv("REMINDER_INTERVAL_SECONDS", "300"))
+# Todos listed in one reminder before it says "and N more"
+REMINDER_MAX_ITEMS = 5
+
+metrics: Dict = {
+    "runs_completed": 0,
+    "users_scanned": 0,
+    "reminders_sent": 0,
+    "reminders_failed": 0,
+    "leases_lost": 0,
+    "errors": 0,
+    "last_run_date": None,
+    "last_run_finished_at": None,
+    "last_error": None,
+}
+
+
+def reminder_body(descriptions: List[str]) -> str:
+    lines = [f"- {description}" for description in descriptions[:REMINDER_MAX_ITEMS]]
+    if len(descriptions) > REMINDER_MAX_ITEMS:
+        lines.append(f"and {len(descriptions) - REMINDER_MAX_ITEMS} more")
+    return "Still to do today:\n" + "\n".join(lines)
+
+
+class ReminderScheduler:
+    """
+    Sends the day's reminders once REMINDER_HOUR has passed, checking every
+    REMINDER_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, db, dispatcher: notifications.NotificationDispatcher, worker_id: Optional[str] = None):
+        self.db = db
+        self.dispatcher = dispatcher
+        self.worker_id = worker_id or f"{os.uname().nodename}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                now = datetime.now()
+                if now.hour >= REMINDER_HOUR:
+                    await self.run(start_of_day(now.date()))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics["errors"] += 1
+                metrics["last_error"] = str(e)
+                logger.exception("Reminder run failed")
+            await asyncio.sleep(REMINDER_INTERVAL_SECONDS)
+
+    async def run(self, day: datetime) -> bool:
+        """
+        Sends the reminders for `day`. Returns False when they were already
+        sent or another worker is sending them.
+        """
+        job_id = f"reminders:{day.date().isoformat()}"
+        checkpoint = await acquire_checkpoint(self.db, job_id, self.worker_id, {"last_user_id": None, "reminders_sent": 0})
+        if checkpoint is None:
+            return False
+
+        query = {"reminders.enabled": True}
+        if checkpoint.get("last_user_id") is not None:
+            query["_id"] = {"$gt": checkpoint["last_user_id"]}
+
+        cursor = self.db.users.find(query, {"reminders": 1}).sort("_id", 1).batch_size(REMINDER_BATCH_SIZE)
+        batch = []
+        async for user in cursor:
+            batch.append(user)
+            if len(batch) >= REMINDER_BATCH_SIZE:
+                if not await self._process_batch(job_id, batch, day):
+                    return False
+                batch = []
+        if batch and not await self._process_batch(job_id, batch, day):
+            return False
+
+        await self.db.scheduler_checkpoints.update_one(
+            {"_id": job_id, "locked_by": self.worker_id},
+            {"$set": {"completed": True, "finished_at": datetime.utcnow()}, "$unset": {"locked_until": ""}},
+        )
+        metrics["runs_completed"] += 1
+        metrics["last_run_date"] = day.date().isoformat()
+        metrics["last_run_finished_at"] = datetime.utcnow()
+        return True
+
+    async def _renew_lease(self, job_id: str, update: Optional[Dict] = None) -> bool:
+        """
+        Extends this worker's lease, applying `update` with it. Returns False
+        when another worker has taken the lease over.
+        """
+        update = update or {}
+        update.setdefault("$set", {})["locked_until"] = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+        result = await self.db.scheduler_checkpoints.update_one({"_id": job_id, "locked_by": self.worker_id}, update)
+        if result.matched_count == 0:
+            metrics["leases_lost"] += 1
+            logger.warning("Lost the lease on %s, leaving it to the worker that holds it", job_id)
+            return False
+        return True
+
+    async def _send(self, job_id: str, messages: List[Dict]) -> Optional[List[bool]]:
+        """
+        Hands `messages` to the dispatcher and waits until each one was sent
+        or given up on, renewing the lease meanwhile. Returns None when the
+        lease was lost.
+        """
+        loop = asyncio.get_running_loop()
+        waiters = [loop.create_future() for _ in messages]
+
+        async def enqueue():
+            for message, waiter in zip(messages, waiters):
+                await self.dispatcher.enqueue({**message, "waiters": [waiter]})
+
+        pending = {asyncio.create_task(enqueue()), *waiters}
+        try:
+            while pending:
+                _, pending = await asyncio.wait(pending, timeout=LEASE_SECONDS / 3)
+                if pending and not await self._renew_lease(job_id):
+                    return None
+        finally:
+            for task in pending:
+                task.cancel()
+        return [waiter.result() for waiter in waiters]
+
+    async def _process_batch(self, job_id: str, users: List[Dict], day: datetime) -> bool:
+        pending: Dict = defaultdict(list)
+        todos = self.db.todos.find(
+            {
+                "user_id": {"$in": [user["_id"] for user in users]},
+                "due_date": {"$gte": day, "$lt": day + timedelta(days=1)},
+                "completed": False,
+            },
+            {"user_id": 1, "description": 1},
+        )
+        async for todo in todos:
+            pending[todo["user_id"]].append(todo["description"])
+
+        messages = [
+            {
+                "user_id": user["_id"],
+                "channel": "sms",
+                "to": user["reminders"]["phone_number"],
+                "body": reminder_body(pending[user["_id"]]),
+                "kind": "reminder",
+            }
+            for user in users
+            if pending.get(user["_id"])
+        ]
+        results = await self._send(job_id, messages)
+        if results is None:
+            return False
+        sent = sum(results)
+
+        if not await self._renew_lease(
+            job_id,
+            {"$set": {"last_user_id": users[-1]["_id"]}, "$inc": {"reminders_sent": sent}},
+        ):
+            return False
+        metrics["users_scanned"] += len(users)
+        metrics["reminders_sent"] += sent
+        metrics["reminders_failed"] += len(results) - sent
+        return True
+
+
+async def main(argv: List[str]) -> int:
+    from app.database import connect
+
+    dispatcher = notifications.NotificationDispatcher()
+    dispatcher.start()
+    sent = await ReminderScheduler(connect(), dispatcher).run(start_of_day(datetime.now().date()))
+    await dispatcher.stop()
+    if not sent:
+        logger.info("Today's reminders were already sent")
+    return 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,193 @@
+"""
+Cached, ETag-validated responses for the read endpoints the frontend polls.
+
+Every user has a data version that write endpoints (and background jobs
+that change what a user sees) bump through `bump`. A cached body is only
+served while the user's version is the one it was rendered at, so there is
+no per-route invalidation to get wrong. Each response carries an ETag
+derived from its body; a matching If-None-Match gets a 304 without a body.
+
+The store is chosen with RESPONSE_CACHE_BACKEND:
+
+- mongo (default): versions in `cache_versions`, shared by all workers and
+  instances, so a write handled anywhere invalidates every copy. Bodies
+  stay in a bounded in-process LRU, or with RESPONSE_CACHE_SHARED_BODIES
+  in `response_cache` (expired by a TTL index).
+- memory: versions and bodies in bounded in-process LRUs. Only correct
+  while a single app process serves a user, since a write handled by one
+  worker does not invalidate the others' copies.
+
+Renders read from a secondary may lag the primary, so routes reading
+through the stats database only cache when it reads the primary.
+"""
+import os
+import hashlib
+import itertools
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+from bson import ObjectId
+from fastapi import Request, Response
+from pymongo import UpdateOne
+from app.cache import LRUCache
+from app.serialization import to_json
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "mongo")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "4096"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+RESPONSE_CACHE_SHARED_BODIES = os.getenv("RESPONSE_CACHE_SHARED_BODIES", "false").lower() == "true"
+
+metrics: Dict = {
+    "hits": 0,
+    "misses": 0,
+    "not_modified": 0,
+    "bumps": 0,
+}
+
+
+class MemoryBackend:
+    def __init__(self, size: int = RESPONSE_CACHE_SIZE, ttl: int = RESPONSE_CACHE_TTL_SECONDS):
+        self.versions = LRUCache(size, float("inf"))
+        self.bodies = LRUCache(size, ttl)
+        # Versions are never reused, so a user whose version was evicted
+        # cannot match a body rendered before the eviction
+        self._next_version = itertools.count(1)
+
+    async def version(self, user_id: ObjectId) -> int:
+        version = self.versions.get(str(user_id))
+        if version is None:
+            version = next(self._next_version)
+            self.versions.set(str(user_id), version)
+        return version
+
+    async def bump(self, user_ids: Iterable[ObjectId]):
+        for user_id in user_ids:
+            self.versions.set(str(user_id), next(self._next_version))
+
+    async def get(self, key: str) -> Optional[Dict]:
+        return self.bodies.get(key)
+
+    async def set(self, key: str, entry: Dict):
+        self.bodies.set(key, entry)
+
+
+class MongoBackend:
+    def __init__(self, ttl: int = RESPONSE_CACHE_TTL_SECONDS, shared_bodies: bool = RESPONSE_CACHE_SHARED_BODIES):
+        self.ttl = ttl
+        self.bodies = None if shared_bodies else LRUCache(RESPONSE_CACHE_SIZE, ttl)
+
+    def _db(self):
+        from app import database
+
+        return database.database
+
+    async def version(self, user_id: ObjectId) -> int:
+        doc = await self._db().cache_versions.find_one({"_id": user_id})
+        return doc["version"] if doc else 0
+
+    async def bump(self, user_ids: Iterable[ObjectId]):
+        operations = [UpdateOne({"_id": user_id}, {"$inc": {"version": 1}}, upsert=True) for user_id in set(user_ids)]
+        if operations:
+            await self._db().cache_versions.bulk_write(operations, ordered=False)
+
+    async def get(self, key: str) -> Optional[Dict]:
+        if self.bodies is not None:
+            return self.bodies.get(key)
+        return await self._db().response_cache.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+
+    async def set(self, key: str, entry: Dict):
+        if self.bodies is not None:
+            self.bodies.set(key, entry)
+            return
+        await self._db().response_cache.replace_one(
+            {"_id": key},
+            {**entry, "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)},
+            upsert=True,
+        )
+
+
+cache_backends = {
+    "memory": MemoryBackend,
+    "mongo": MongoBackend,
+}
+
+
+def register_cache_backend(name: str, backend):
+    cache_backends[name] = backend
+
+
+backend = cache_backends[RESPONSE_CACHE_BACKEND]()
+
+
+async def bump(*user_ids: ObjectId):
+    """
+    Invalidates every cached response of the given users.
+    """
+    metrics["bumps"] += 1
+    await backend.bump(user_ids)
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+async def _render(render: Callable[[Response], Awaitable[Any]]):
+    response = Response()
+    content = await render(response)
+    # Only the headers the handler added, not Response()'s own
+    headers = {name: value for name, value in response.headers.items() if name.startswith("x-")}
+    return to_json(content), headers
+
+
+async def cached_response(
+    request: Request,
+    user_id: ObjectId,
+    route: str,
+    render: Callable[[Response], Awaitable[Any]],
+    cacheable: bool = True,
+) -> Response:
+    """
+    Returns the user's cached response for `route` and the request's query
+    string if it is still current, otherwise renders it with `render`,
+    which gets a Response to set extra headers on and returns the content
+    (see app/serialization.py). With `cacheable` False the response is
+    always rendered and not stored, e.g. when it was read from a secondary.
+    Answers 304 when the client already has this body.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        body, headers = await _render(render)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    if not cacheable:
+        body, extra = await _render(render)
+        entry = {"body": body, "etag": _etag(body), "headers": extra}
+        return _respond(request, entry)
+
+    # Read the version first: a write that lands while rendering bumps it
+    # past the one stored with the entry, so the entry is never served
+    version = await backend.version(user_id)
+    key = f"{user_id}:{route}:{request.url.query}"
+    entry = await backend.get(key)
+    if entry is not None and entry["version"] == version:
+        metrics["hits"] += 1
+    else:
+        metrics["misses"] += 1
+        body, extra = await _render(render)
+        entry = {"version": version, "body": body, "etag": _etag(body), "headers": extra}
+        await backend.set(key, entry)
+    return _respond(request, entry)
+
+
+def _respond(request: Request, entry: Dict) -> Response:
+    headers = {**entry["headers"], "ETag": entry["etag"], "Cache-Control": "private, no-cache"}
+    if _matches(request.headers.get("if-none-match"), entry["etag"]):
+        metrics["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
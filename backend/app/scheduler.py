@@ -0,0 +1,172 @@
+import os
+import asyncio
+import logging
+from typing import Dict, Optional
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.todo_service import build_todo, materialize_todos, start_of_day
+from app.purge import NOT_DELETED
+from app import response_cache, events
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("TODO_SCHEDULER_ENABLED", "true").lower() == "true"
+BATCH_SIZE = int(os.getenv("TODO_SCHEDULER_BATCH_SIZE", "500"))
+INTERVAL_SECONDS = int(os.getenv("TODO_SCHEDULER_INTERVAL_SECONDS", "300"))
+# How long before midnight the next day's todos are generated. Todos count
+# towards goal progress as soon as they exist, so the default waits for the
+# day to start; the job still runs long before the morning peak.
+LEAD_MINUTES = int(os.getenv("TODO_SCHEDULER_LEAD_MINUTES", "0"))
+LEASE_SECONDS = int(os.getenv("TODO_SCHEDULER_LEASE_SECONDS", "120"))
+
+metrics: Dict = {
+    "runs_started": 0,
+    "runs_completed": 0,
+    "batches": 0,
+    "habits_scanned": 0,
+    "todos_created": 0,
+    "errors": 0,
+    "last_run_date": None,
+    "last_run_started_at": None,
+    "last_run_finished_at": None,
+    "last_error": None,
+}
+
+
+async def acquire_checkpoint(db, job_id: str, worker_id: str, initial: Dict) -> Optional[Dict]:
+    """
+    Takes or renews the lease on the checkpoint of `job_id`, creating it
+    with the fields in `initial`. Returns None when the job is already
+    completed or another worker holds the lease.
+    """
+    now = datetime.utcnow()
+    try:
+        return await db.scheduler_checkpoints.find_one_and_update(
+            {
+                "_id": job_id,
+                "completed": {"$ne": True},
+                "$or": [{"locked_until": {"$lt": now}}, {"locked_by": worker_id}],
+            },
+            {
+                "$set": {"locked_by": worker_id, "locked_until": now + timedelta(seconds=LEASE_SECONDS)},
+                "$setOnInsert": initial,
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return None
+
+
+class TodoScheduler:
+    """
+    Pre-generates the todos of every daily habit for the coming day so the
+    first dashboard load of the day only has to read them.
+
+    Progress is checkpointed per day in `scheduler_checkpoints` after every
+    batch, which lets a restarted worker resume where the last one stopped.
+    The checkpoint document doubles as a lease so only one worker generates
+    a given day at a time.
+    """
+
+    def __init__(self, db, worker_id: Optional[str] = None):
+        self.db = db
+        self.worker_id = worker_id or f"{os.uname().nodename}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                target = start_of_day((datetime.now() + timedelta(minutes=LEAD_MINUTES)).date())
+                await self.run(target)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics["errors"] += 1
+                metrics["last_error"] = str(e)
+                logger.exception("Todo scheduler run failed")
+            await asyncio.sleep(INTERVAL_SECONDS)
+
+    async def run(self, due_date: datetime) -> bool:
+        """
+        Generates todos due on `due_date`, resuming from the last checkpoint.
+        Returns False when the day was already done or is being generated
+        by another worker.
+        """
+        job_id = f"daily_todos:{due_date.date().isoformat()}"
+        checkpoint = await acquire_checkpoint(self.db, job_id, self.worker_id, {"last_habit_id": None, "todos_created": 0})
+        if checkpoint is None:
+            return False
+
+        metrics["runs_started"] += 1
+        metrics["last_run_date"] = due_date.date().isoformat()
+        metrics["last_run_started_at"] = datetime.utcnow()
+
+        query = {"frequency": "daily"}
+        if checkpoint.get("last_habit_id") is not None:
+            query["_id"] = {"$gt": checkpoint["last_habit_id"]}
+
+        cursor = self.db.habits.find(query, {"description": 1, "goal_id": 1}).sort("_id", 1).batch_size(BATCH_SIZE)
+        batch = []
+        async for habit in cursor:
+            batch.append(habit)
+            if len(batch) >= BATCH_SIZE:
+                await self._process_batch(job_id, batch, due_date)
+                batch = []
+        if batch:
+            await self._process_batch(job_id, batch, due_date)
+
+        await self.db.scheduler_checkpoints.update_one(
+            {"_id": job_id},
+            {"$set": {"completed": True, "finished_at": datetime.utcnow()}, "$unset": {"locked_until": ""}},
+        )
+        metrics["runs_completed"] += 1
+        metrics["last_run_finished_at"] = datetime.utcnow()
+        return True
+
+    async def _process_batch(self, job_id: str, habits, due_date: datetime):
+        goal_ids = list({habit["goal_id"] for habit in habits})
+        goals = await self.db.goals.find({"_id": {"$in": goal_ids}, **NOT_DELETED}, {"user_id": 1}).to_list(length=None)
+        owners = {goal["_id"]: goal["user_id"] for goal in goals}
+
+        todos = [
+            build_todo(habit, owners[habit["goal_id"]], due_date)
+            for habit in habits
+            if habit["goal_id"] in owners
+        ]
+        new_ids = {todo["_id"] for todo in todos}
+        stored = await materialize_todos(self.db, todos, due_date)
+        created = [todo for todo in stored if todo["_id"] in new_ids]
+        if created:
+            users = {todo["user_id"] for todo in created}
+            await response_cache.bump(*users)
+            for user_id in users:
+                events.emit(user_id, {"type": "changed", "scope": "todos"})
+
+        await self.db.scheduler_checkpoints.update_one(
+            {"_id": job_id},
+            {
+                "$set": {
+                    "last_habit_id": habits[-1]["_id"],
+                    "locked_until": datetime.utcnow() + timedelta(seconds=LEASE_SECONDS),
+                },
+                "$inc": {"todos_created": len(created)},
+            },
+        )
+        metrics["batches"] += 1
+        metrics["habits_scanned"] += len(habits)
+        metrics["todos_created"] += len(created)
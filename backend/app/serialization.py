@@ -0,0 +1,87 @@
+"""
+Lean JSON responses for read-heavy endpoints.
+
+The usual path builds a Pydantic model from every Mongo document, validates
+each id through PyObjectId, and FastAPI validates and encodes the result a
+second time through the route's response_model. For documents that come
+straight from our own collections none of that finds anything to fix.
+
+`shape` copies a document into the response layout of a model (field
+names, aliases, defaults and nested models) without validating it, and
+`to_json` encodes the result with orjson, which handles datetimes itself;
+ObjectIds become strings. The output matches what the model path produces.
+"""
+import enum
+import typing
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Type
+import orjson
+from bson import ObjectId
+from fastapi import Response
+from pydantic import BaseModel
+
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", by_alias=True)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def to_json(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class LeanJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+def _nested_model(annotation) -> Tuple[Optional[Type[BaseModel]], bool]:
+    """
+    Returns (model, is_list) for fields typed as a model, a list of models
+    or an Optional of either.
+    """
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return _nested_model(args[0]) if len(args) == 1 else (None, False)
+    if origin in (list, List):
+        model, _ = _nested_model(typing.get_args(annotation)[0])
+        return model, model is not None
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation, False
+    return None, False
+
+
+@lru_cache(maxsize=None)
+def _layout(model: Type[BaseModel]):
+    layout = []
+    for name, field in model.model_fields.items():
+        key = field.alias or name
+        nested, is_list = _nested_model(field.annotation)
+        default = None if field.is_required() or field.default_factory else field.default
+        if isinstance(default, enum.Enum):
+            default = default.value
+        layout.append((key, name, default, nested, is_list))
+    return layout
+
+
+def shape(doc: Dict, model: Type[BaseModel]) -> Dict:
+    """
+    Projects a trusted Mongo document onto `model`'s JSON layout: only the
+    model's fields, by alias, with defaults for missing ones. Nothing is
+    validated.
+    """
+    out = {}
+    for key, name, default, nested, is_list in _layout(model):
+        value = doc.get(key, doc.get(name, default))
+        if nested is not None and value is not None:
+            value = [shape(item, nested) for item in value] if is_list else shape(value, nested)
+        elif isinstance(value, enum.Enum):
+            value = value.value
+        out[key] = value
+    return out
@@ -0,0 +1,44 @@
+"""
+How long a worker takes to become ready.
+
+app.main imports this module first, so `metrics["import_seconds"]` covers
+importing the app, and the lifespan times each of its steps with `phase`.
+`ready` logs the report once the worker starts serving; the numbers are
+also on /metrics (startup_*) and GET /api/v1/health/startup.
+"""
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+_started = time.perf_counter()
+
+metrics: Dict = {
+    "import_seconds": 0.0,
+    "ready_seconds": 0.0,
+}
+
+
+def imported():
+    metrics["import_seconds"] = round(time.perf_counter() - _started, 4)
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics[f"{name}_seconds"] = round(time.perf_counter() - started, 4)
+
+
+def ready():
+    metrics["ready_seconds"] = round(time.perf_counter() - _started, 4)
+    steps = ", ".join(
+        f"{key.removesuffix('_seconds')} {value:.3f}s"
+        for key, value in metrics.items()
+        if key != "ready_seconds"
+    )
+    logger.info("Worker ready in %.3fs (%s)", metrics["ready_seconds"], steps)
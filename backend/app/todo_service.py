@@ -0,0 +1,266 @@
+import os
+from typing import List, Dict, Optional, Tuple
+from datetime import datetime, date, timedelta, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+from app.counters import apply_todo_deltas
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Deleted todos are remembered this long so that sync clients learn about
+# them; a client whose cursor is older has to fetch a full snapshot again
+TOMBSTONE_TTL_DAYS = int(os.getenv("TODO_TOMBSTONE_TTL_DAYS", "30"))
+# Writes are stamped with the app's clock before they commit, so one can
+# land with a stamp older than todos a client already synced. A caught-up
+# cursor stays this far behind now so the next sync still sees it.
+SYNC_OVERLAP_SECONDS = float(os.getenv("TODO_SYNC_OVERLAP_SECONDS", "5"))
+
+
+def start_of_day(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day)
+
+
+def now_ms() -> datetime:
+    """
+    The current UTC time truncated to what Mongo stores, so a stamp written
+    to a document compares equal to itself when read back.
+    """
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def build_todo(habit: Dict, user_id: ObjectId, due_date: datetime) -> Dict:
+    return {
+        "_id": ObjectId(),
+        "description": habit["description"],
+        "completed": False,
+        "due_date": due_date,
+        "user_id": user_id,
+        "habit_id": habit["_id"],
+        "goal_id": habit["goal_id"],
+        "updated_at": now_ms(),
+    }
+
+
+async def materialize_todos(db, todos: List[Dict], due_date: datetime) -> List[Dict]:
+    """
+    Makes sure a todo exists for every habit in `todos` on `due_date` and
+    returns the stored documents in the same order.
+
+    Existing todos are fetched with one query and the missing ones are written
+    with a single unordered insert, and the progress counters of their
+    habits and goals are bumped. The unique (habit_id, due_date) index turns
+    a concurrent insert of the same todo into a duplicate key error, in which
+    case the document that won the race is read back instead.
+    """
+    if not todos:
+        return []
+
+    habit_ids = [todo["habit_id"] for todo in todos]
+    day_range = {"$gte": due_date, "$lt": due_date + timedelta(days=1)}
+
+    existing = await db.todos.find({"habit_id": {"$in": habit_ids}, "due_date": day_range}).to_list(length=None)
+    by_habit = {todo["habit_id"]: todo for todo in existing}
+
+    missing = [todo for todo in todos if todo["habit_id"] not in by_habit]
+    if missing:
+        try:
+            await db.todos.insert_many(missing, ordered=False)
+            conflicted = []
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in write_errors):
+                raise
+            conflicted = [missing[error["index"]]["habit_id"] for error in write_errors]
+
+        failed = set(conflicted)
+        inserted = [todo for todo in missing if todo["habit_id"] not in failed]
+        for todo in inserted:
+            by_habit[todo["habit_id"]] = todo
+        await apply_todo_deltas(db, [(todo, 1, 0) for todo in inserted])
+
+        if conflicted:
+            winners = await db.todos.find({"habit_id": {"$in": conflicted}, "due_date": day_range}).to_list(length=None)
+            for todo in winners:
+                by_habit[todo["habit_id"]] = todo
+
+    return [by_habit[habit_id] for habit_id in habit_ids if habit_id in by_habit]
+
+
+async def delete_tombstones(db, todos: List[Dict], deleted_at: datetime):
+    if todos:
+        await db.todo_tombstones.insert_many(
+            [{"todo_id": todo["_id"], "user_id": todo["user_id"], "deleted_at": deleted_at} for todo in todos],
+            ordered=False,
+        )
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+async def apply_todo_batch(db, user_id: ObjectId, items: List) -> List[Dict]:
+    """
+    Applies a batch of todo updates and deletes of one user and returns a
+    result per item, in order.
+
+    The targeted todos are read once, then written with one bulk write per
+    kind. Each write only matches if the todo still has the `updated_at`
+    that was read, so a todo changed in between is reported as a conflict
+    instead of being overwritten, and counter deltas stay exact. When an
+    item carries `client_updated_at`, it is skipped as stale if the todo
+    was already changed by a later client write. Several items for one todo
+    are applied in order.
+    """
+    results: List[Dict] = [{"id": item.id, "status": "ok"} for item in items]
+    ids = {}
+    for index, item in enumerate(items):
+        try:
+            ids[index] = ObjectId(item.id)
+        except (InvalidId, TypeError):
+            results[index]["status"] = "invalid"
+            continue
+        if item.op == "update" and item.completed is None:
+            results[index]["status"] = "invalid"
+            del ids[index]
+
+    existing = await db.todos.find({"_id": {"$in": list(set(ids.values()))}, "user_id": user_id}).to_list(length=None)
+    current = {todo["_id"]: todo for todo in existing}
+
+    # Fold the items into one final state per todo
+    final: Dict[ObjectId, Tuple[Dict, Optional[Dict], List[int]]] = {}
+    for index, todo_id in ids.items():
+        item = items[index]
+        if todo_id not in current:
+            results[index]["status"] = "not_found"
+            continue
+        original, state, applied = final.setdefault(todo_id, (current[todo_id], dict(current[todo_id]), []))
+        if state is None:
+            results[index]["status"] = "not_found"
+            continue
+        client_updated_at = _utc(item.client_updated_at)
+        if client_updated_at and state.get("client_updated_at") and client_updated_at < state["client_updated_at"]:
+            results[index]["status"] = "stale"
+            continue
+        if item.op == "delete":
+            final[todo_id] = (original, None, applied + [index])
+            continue
+        state["completed"] = item.completed
+        if client_updated_at:
+            state["client_updated_at"] = client_updated_at
+        applied.append(index)
+
+    now = now_ms()
+    updates, deletes = [], []
+    for todo_id, (original, state, applied) in final.items():
+        if not applied:
+            continue
+        guard = {"_id": todo_id, "user_id": user_id, "updated_at": original.get("updated_at")}
+        if state is None:
+            deletes.append((original, DeleteOne(guard), applied))
+        elif state["completed"] != original["completed"] or state.get("client_updated_at") != original.get("client_updated_at"):
+            changes = {"completed": state["completed"], "updated_at": now}
+            if state.get("client_updated_at"):
+                changes["client_updated_at"] = state["client_updated_at"]
+            updates.append((original, UpdateOne(guard, {"$set": changes}), applied))
+
+    deltas = []
+    if updates:
+        result = await db.todos.bulk_write([op for _, op, _ in updates], ordered=False)
+        written = {todo["_id"] for todo, _, _ in updates}
+        if result.matched_count < len(updates):
+            stamped = await db.todos.find({"_id": {"$in": list(written)}, "updated_at": now}, {"_id": 1}).to_list(length=None)
+            written = {todo["_id"] for todo in stamped}
+        for original, _, applied in updates:
+            if original["_id"] not in written:
+                for index in applied:
+                    results[index]["status"] = "conflict"
+                continue
+            completed = final[original["_id"]][1]["completed"]
+            if completed != original["completed"]:
+                deltas.append((original, 0, 1 if completed else -1))
+
+    if deletes:
+        result = await db.todos.bulk_write([op for _, op, _ in deletes], ordered=False)
+        removed = {todo["_id"] for todo, _, _ in deletes}
+        if result.deleted_count < len(deletes):
+            remaining = await db.todos.find({"_id": {"$in": list(removed)}}, {"_id": 1}).to_list(length=None)
+            removed -= {todo["_id"] for todo in remaining}
+        gone = []
+        for original, _, applied in deletes:
+            if original["_id"] not in removed:
+                for index in applied:
+                    results[index]["status"] = "conflict"
+                continue
+            gone.append(original)
+            deltas.append((original, -1, -1 if original["completed"] else 0))
+        await delete_tombstones(db, gone, now)
+
+    await apply_todo_deltas(db, deltas)
+    return results
+
+
+def encode_cursor(todo: Dict) -> str:
+    updated_at = todo.get("updated_at")
+    stamp = str(int(updated_at.replace(tzinfo=timezone.utc).timestamp() * 1000)) if updated_at else ""
+    return f"{stamp}:{todo['_id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], ObjectId]:
+    try:
+        stamp, todo_id = cursor.split(":")
+        updated_at = datetime.utcfromtimestamp(int(stamp) / 1000) if stamp else None
+        return updated_at, ObjectId(todo_id)
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def todo_changes(db, user_id: ObjectId, cursor: Optional[str], limit: int) -> Dict:
+    """
+    Returns the user's todos changed after `cursor`, oldest change first,
+    and the ids of todos deleted since then. Without a cursor every todo is
+    returned, so the first sync is a full snapshot. Todos are paged by
+    (updated_at, _id), which keeps the order stable when a batch stamps many
+    todos with the same time.
+
+    The last page's cursor is the time SYNC_OVERLAP_SECONDS ago, so a todo
+    changed in that window may be returned twice. A cursor without a
+    stamp is still in the todos of a snapshot that predate stamps, so it
+    gets every deletion on record.
+    """
+    query: Dict = {"user_id": user_id}
+    deleted: List[ObjectId] = []
+    if cursor:
+        updated_at, todo_id = decode_cursor(cursor)
+        if updated_at is None:
+            query["$or"] = [{"updated_at": None, "_id": {"$gt": todo_id}}, {"updated_at": {"$type": "date"}}]
+            tombstone_query = {"user_id": user_id}
+        else:
+            if updated_at < datetime.utcnow() - timedelta(days=TOMBSTONE_TTL_DAYS):
+                raise HTTPException(status_code=410, detail="Cursor expired, fetch a full snapshot")
+            query["$or"] = [{"updated_at": {"$gt": updated_at}}, {"updated_at": updated_at, "_id": {"$gt": todo_id}}]
+            tombstone_query = {"user_id": user_id, "deleted_at": {"$gte": updated_at}}
+        tombstones = db.todo_tombstones.find(tombstone_query, {"todo_id": 1})
+        deleted = [tombstone["todo_id"] async for tombstone in tombstones]
+
+    todos = await db.todos.find(query).sort([("updated_at", 1), ("_id", 1)]).limit(limit + 1).to_list(length=limit + 1)
+    has_more = len(todos) > limit
+    todos = todos[:limit]
+    if has_more:
+        next_cursor = encode_cursor(todos[-1])
+    else:
+        # Caught up: the cursor is a point in time, so it only expires once
+        # the client stops syncing, however old the user's last change is
+        settled = now_ms() - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+        next_cursor = encode_cursor({"_id": ObjectId("0" * 24), "updated_at": settled})
+    return {
+        "todos": todos,
+        "deleted": deleted,
+        "cursor": next_cursor,
+        "has_more": has_more,
+    }
@@ -0,0 +1,128 @@
+"""
+Measures GET /todos/ latency while POST /goals is flooded, with admission
+control off and on.
+
+The habit plan backend is replaced by one that holds the event loop for
+--plan-cpu-ms (parsing, validation and serialization of a large LLM
+answer) after waiting --plan-latency-ms for the model. Reports read
+latency percentiles and how the goal requests were answered.
+
+    python -m benchmarks.bench_admission --in-memory --writers 64 --readers 8 --seconds 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import seed as seeding
+from benchmarks.load_test import app_client, percentile, use_in_memory_database
+
+
+async def run(client, tokens: List[str], writers: int, readers: int, seconds: float) -> Dict:
+    deadline = time.perf_counter() + seconds
+    read_latencies: List[float] = []
+    goal_statuses: Counter = Counter()
+
+    async def writer(i: int):
+        n = 0
+        while time.perf_counter() < deadline:
+            n += 1
+            response = await client.post(
+                "/api/v1/goals",
+                headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"},
+                json={"description": f"Flood goal {i} {n} {time.time_ns()}"},
+            )
+            goal_statuses[response.status_code] += 1
+            if response.status_code in (429, 503):
+                await asyncio.sleep(min(float(response.headers.get("Retry-After", "1")), 0.1))
+
+    async def reader(i: int):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await client.get("/api/v1/todos/", headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"})
+            read_latencies.append(time.perf_counter() - started)
+            # With --in-memory a request may never suspend; let the writers run
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(writer(i) for i in range(writers)), *(reader(i) for i in range(readers)))
+    values = sorted(read_latencies)
+    return {
+        "reads": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "goals": dict(sorted(goal_statuses.items())),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--writers", type=int, default=64)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--plan-latency-ms", type=float, default=200)
+    parser.add_argument("--plan-cpu-ms", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=4, help="GOAL_PLAN_CONCURRENCY")
+    parser.add_argument("--max-waiting", type=int, default=8, help="GOAL_PLAN_MAX_WAITING")
+    parser.add_argument("--in-memory", action="store_true")
+    args = parser.parse_args()
+
+    os.environ["AI_BACKEND"] = "bench"
+    os.environ.setdefault("TODO_SCHEDULER_ENABLED", "false")
+    os.environ["GOAL_PLAN_CONCURRENCY"] = str(args.concurrency)
+    os.environ["GOAL_PLAN_MAX_WAITING"] = str(args.max_waiting)
+    # Only the concurrency limit is under test here
+    os.environ["GOAL_PLAN_RATE_PER_MINUTE"] = "1000000"
+    os.environ["GOAL_PLAN_BURST"] = "1000000"
+    os.environ["AUTH_RATE_PER_MINUTE"] = "1000000"
+    os.environ["AUTH_BURST"] = "1000000"
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if args.in_memory:
+        use_in_memory_database()
+
+    from app import admission, ai_service, database
+    from app.indexes import ensure_indexes
+
+    async def bench_plan_backend(goal_description: str):
+        await asyncio.sleep(args.plan_latency_ms / 1000)
+        busy_until = time.perf_counter() + args.plan_cpu_ms / 1000
+        while time.perf_counter() < busy_until:
+            pass
+        return await ai_service.stub_plan_backend(goal_description)
+
+    ai_service.register_plan_backend("bench", bench_plan_backend)
+
+    db = database.connect()
+    await ensure_indexes(db)
+    emails = await seeding.seed(db, args.users, 2, 3, 30)
+
+    async with app_client("") as client:
+        tokens = []
+        for email in emails:
+            response = await client.post("/api/v1/auth/login", data={"username": email, "password": seeding.PASSWORD})
+            tokens.append(response.json()["access_token"])
+
+        print(f"{args.writers} goal writers, {args.readers} todo readers, {args.seconds:.0f}s each")
+        print(f"{'admission':<10}{'reads':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}   goal responses")
+        for enabled in (False, True):
+            admission.ADMISSION_ENABLED = enabled
+            result = await run(client, tokens, args.writers, args.readers, args.seconds)
+            print(
+                f"{'on' if enabled else 'off':<10}{result['reads']:>8}{result['p50_ms']:>10.1f}"
+                f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}   {result['goals']}"
+            )
+
+    database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
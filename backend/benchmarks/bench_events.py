@@ -0,0 +1,87 @@
+"""
+How many live-update subscribers one worker can hold.
+
+Opens --subscribers event streams (split over --users users) on the
+in-process bus, then publishes --rounds of one todo event per user and
+reports the memory held per subscriber and how long delivery took from
+publish to the stream yielding the encoded event. Socket writes are not
+included.
+
+    python -m benchmarks.bench_events --subscribers 10000 --users 5000 --rounds 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import percentile
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["EVENTS_MAX_SUBSCRIBERS"] = str(args.subscribers)
+    from bson import ObjectId
+    from app import events
+
+    users = [ObjectId() for _ in range(args.users)]
+    latencies = []
+    received = 0
+    published_at = 0.0
+    round_done = asyncio.Event()
+
+    async def consume(subscription):
+        nonlocal received
+        async for _ in events.stream(subscription, heartbeat=3600):
+            if published_at:
+                latencies.append(time.perf_counter() - published_at)
+                received += 1
+                if received == args.subscribers:
+                    round_done.set()
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tasks = []
+    for i in range(args.subscribers):
+        subscription = events.bus.subscribe(users[i % args.users])
+        tasks.append(asyncio.create_task(consume(subscription)))
+    await asyncio.sleep(0.1)
+    per_subscriber = (tracemalloc.get_traced_memory()[0] - baseline) / args.subscribers
+    tracemalloc.stop()
+
+    todo = {"_id": ObjectId(), "description": "Benchmark todo", "completed": True, "due_date": datetime(2024, 1, 1)}
+    publish_times = []
+    for _ in range(args.rounds):
+        received = 0
+        round_done.clear()
+        published_at = time.perf_counter()
+        for user_id in users:
+            events.bus.publish(user_id, events.todo_event({**todo, "user_id": user_id}))
+        publish_times.append(time.perf_counter() - published_at)
+        await round_done.wait()
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    values = sorted(latencies)
+    print(f"{args.subscribers} subscribers for {args.users} users, {args.rounds} rounds")
+    print(f"memory per subscriber  {per_subscriber / 1024:8.1f} KiB")
+    print(f"publish to all users   {sum(publish_times) / len(publish_times) * 1000:8.1f} ms per round")
+    print(
+        f"delivery latency       p50 {percentile(values, 50) * 1000:.1f} ms   "
+        f"p99 {percentile(values, 99) * 1000:.1f} ms   max {values[-1] * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
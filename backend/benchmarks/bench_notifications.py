@@ -0,0 +1,70 @@
+"""
+Measures how long the notification dispatcher takes to deliver a reminder
+blast through a provider with a fixed latency per API call, compared with
+sending one message per call, in sequence.
+
+    python -m benchmarks.bench_notifications --users 100000 --latency-ms 50 --provider-batch 100
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SlowProvider:
+    def __init__(self, max_batch: int, latency: float):
+        self.max_batch = max_batch
+        self.latency = latency
+        self.calls = 0
+
+    async def send(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [None] * len(messages)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--reminders-per-user", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--provider-batch", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    from bson import ObjectId
+    from app import notifications
+
+    latency = args.latency_ms / 1000
+    provider = SlowProvider(args.provider_batch, latency)
+    notifications.register_provider("bench", provider)
+    notifications.channel_providers["sms"] = "bench"
+
+    dispatcher = notifications.NotificationDispatcher(workers=args.workers)
+    dispatcher.start()
+    started = time.perf_counter()
+    for i in range(args.users):
+        user_id = ObjectId()
+        for n in range(args.reminders_per_user):
+            await dispatcher.enqueue({
+                "user_id": user_id,
+                "channel": "sms",
+                "to": f"+1555{i:07d}",
+                "body": f"Reminder {n}",
+                "kind": "reminder",
+            })
+    await dispatcher.queue.join()
+    elapsed = time.perf_counter() - started
+    await dispatcher.stop()
+
+    messages = args.users * args.reminders_per_user
+    print(f"{messages} reminders for {args.users} users, {args.workers} workers, {args.latency_ms:.0f} ms per provider call")
+    print(f"dispatcher  {elapsed:8.1f} s   {notifications.metrics['sent']} sent in {provider.calls} calls, {notifications.metrics['coalesced']} coalesced")
+    print(f"one by one  {messages * latency:8.1f} s   (estimated, {messages} calls)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+Compares password verification inline on the event loop with the pooled
+password service, under concurrent logins.
+
+Reports logins per second and the worst event loop stall seen by a
+heartbeat task, which is what every other request on the worker feels.
+
+    python -m benchmarks.bench_password_hashing --logins 64 --rounds 12
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def heartbeat(stop: asyncio.Event, interval: float = 0.005) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def run(label: str, login, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await login()
+
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worst_stall = await beat
+    print(f"{label:<8} {logins / elapsed:8.1f} logins/s   worst loop stall {worst_stall * 1000:8.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    os.environ["PASSWORD_HASH_MAX_PENDING"] = str(args.logins)
+    from app import password_service
+
+    hashed = password_service.get_pwd_context().hash("benchmark-password")
+
+    async def inline_login():
+        password_service.get_pwd_context().verify("benchmark-password", hashed)
+
+    async def pooled_login():
+        await password_service.verify_password("benchmark-password", hashed)
+
+    print(f"bcrypt cost {args.rounds}, {args.workers} workers, {args.concurrency} concurrent logins")
+    await run("inline", inline_login, args.logins, args.concurrency)
+    await run("pooled", pooled_login, args.logins, args.concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+Compares encoding goal lists the model way (a GoalWithProgress per goal,
+then jsonable_encoder and JSONResponse) with shape() and orjson, and checks
+that both produce the same JSON.
+
+    python -m benchmarks.bench_serialization --goals 500 --repeat 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_goals(count: int):
+    from bson import ObjectId
+
+    user_id = ObjectId()
+    now = datetime.utcnow().replace(microsecond=123000)
+    goals = []
+    for i in range(count):
+        goal_id = ObjectId()
+        goals.append({
+            "_id": goal_id,
+            "user_id": user_id,
+            "description": f"Goal number {i}",
+            "category": "Health",
+            "status": "in_progress",
+            "completion_date": now + timedelta(days=90),
+            "created_at": now,
+            "todo_count": 120,
+            "completed_count": 57,
+            "progress": 47.5,
+            "todos_completed": 57,
+            "todos_total": 120,
+            "habits": [
+                {"_id": ObjectId(), "description": f"Habit {j}", "frequency": "daily", "goal_id": goal_id}
+                for j in range(3)
+            ],
+        })
+    return goals
+
+
+def timed(label: str, encode, repeat: int, goals: int) -> bytes:
+    body = encode()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        encode()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f"{label:<8} {elapsed * 1000:8.2f} ms per response   {goals / elapsed:10.0f} goals/s   {len(body)} bytes")
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--goals", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from app.models import GoalWithProgress
+    from app.serialization import shape, to_json
+
+    goals = make_goals(args.goals)
+
+    def model_path():
+        return JSONResponse(jsonable_encoder([GoalWithProgress(**goal) for goal in goals])).body
+
+    def lean_path():
+        return to_json([shape(goal, GoalWithProgress) for goal in goals])
+
+    print(f"{args.goals} goals per response")
+    model_body = timed("model", model_path, args.repeat, args.goals)
+    lean_body = timed("lean", lean_path, args.repeat, args.goals)
+    if json.loads(model_body) != json.loads(lean_body):
+        sys.exit("lean output differs from the model output")
+
+
+if __name__ == "__main__":
+    main()
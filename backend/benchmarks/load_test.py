@@ -0,0 +1,258 @@
+"""
+Concurrent load test of the main API workloads with a stubbed LLM.
+
+Seeds a local MongoDB, runs the app in process (or targets --base-url)
+and drives register, login, create-goal, list-goals, daily-todos and
+toggle-todo phases, reporting p50/p95/p99 latency and throughput per
+endpoint.
+
+    MONGO_URL=mongodb://localhost:27017 MONGO_DB_NAME=habit_builder_bench \\
+        python -m benchmarks.load_test --users 50 --days 365 --requests 500 --concurrency 32
+
+Keep the numbers of a run with --output and fail a later run that is more
+than --max-regression slower at p95 with --baseline:
+
+    python -m benchmarks.load_test --output bench_output.json
+    python -m benchmarks.load_test --baseline bench_output.json --max-regression 0.25
+
+--in-memory uses mongomock-motor instead of a mongod (see
+benchmarks/requirements.txt). It has no transactions, change streams or
+shared response cache, so those paths are only measured against a real
+server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import seed as seeding
+
+PHASES = ["register", "login", "create-goal", "list-goals", "daily-todos", "toggle-todo"]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(name: str, latencies: List[float], errors: int, elapsed: float) -> Dict:
+    values = sorted(latencies)
+    return {
+        "endpoint": name,
+        "requests": len(values) + errors,
+        "errors": errors,
+        "throughput": len(values) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+    }
+
+
+async def run_phase(name: str, requests: int, concurrency: int, call: Callable) -> Dict:
+    """
+    Issues `requests` calls of `call(i)` with at most `concurrency` in flight.
+    """
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await call(i)
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(name, latencies, errors, time.perf_counter() - started)
+
+
+@asynccontextmanager
+async def app_client(base_url: str):
+    import httpx
+
+    if base_url:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            yield client
+        return
+
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            yield client
+
+
+def use_in_memory_database():
+    # mongomock has no sessions, so goals are created without transactions
+    os.environ["MONGO_TRANSACTIONS"] = "false"
+    # One process, and mongomock lacks the bulk writes the shared cache uses
+    os.environ.setdefault("RESPONSE_CACHE_BACKEND", "memory")
+    from mongomock_motor import AsyncMongoMockClient
+    from app import database
+
+    from mongomock.collection import BulkOperationBuilder
+
+    # pymongo 4.9+ passes a `sort` to every bulk update and replace, which
+    # mongomock's builder does not take; the app never sets one
+    for name in ("add_update", "add_replace"):
+        def without_sort(self, *args, _add=getattr(BulkOperationBuilder, name), sort=None, **kwargs):
+            return _add(self, *args, **kwargs)
+
+        setattr(BulkOperationBuilder, name, without_sort)
+
+    mock_db = AsyncMongoMockClient()[database.MONGO_DB_NAME]
+
+    def connect():
+        database.database = database.stats_database = mock_db
+        return mock_db
+
+    database.connect = connect
+    database.close = lambda: None
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    seeding.add_arguments(parser)
+    parser.add_argument("--requests", type=int, default=200, help="requests per phase")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--phases", default=",".join(PHASES))
+    parser.add_argument("--base-url", default="", help="benchmark a running server instead of the app in process")
+    parser.add_argument("--in-memory", action="store_true")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None)
+    parser.add_argument("--output", default="")
+    parser.add_argument("--baseline", default="")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # The plan generation and todo scheduler must be in place before the
+    # app modules read their settings
+    os.environ["AI_BACKEND"] = "stub"
+    os.environ.setdefault("OPENAI_API_KEY", "unused")
+    os.environ.setdefault("TODO_SCHEDULER_ENABLED", "false")
+    # Measure capacity, not the per-user rate limits
+    os.environ.setdefault("ADMISSION_ENABLED", "false")
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if args.in_memory:
+        use_in_memory_database()
+
+    from app import database
+    from app.indexes import ensure_indexes
+
+    db = database.connect()
+    await ensure_indexes(db)
+    emails = await seeding.seed(db, args.users, args.goals, args.habits, args.days, args.completion_rate)
+
+    phases = args.phases.split(",")
+    results = []
+    rng = random.Random(7)
+    async with app_client(args.base_url) as client:
+        tokens: List[str] = []
+
+        async def login(i: int):
+            response = await client.post(
+                "/api/v1/auth/login",
+                data={"username": emails[i % len(emails)], "password": seeding.PASSWORD},
+            )
+            if response.status_code == 200 and len(tokens) < len(emails):
+                tokens.append(response.json()["access_token"])
+            return response
+
+        def headers(i: int) -> Dict:
+            return {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+
+        async def register(i: int):
+            return await client.post(
+                "/api/v1/auth/register",
+                json={"email": f"bench_register_{time.time_ns()}_{i}@example.com", "password": seeding.PASSWORD},
+            )
+
+        async def create_goal(i: int):
+            return await client.post("/api/v1/goals", headers=headers(i), json={"description": f"Benchmark goal {i}"})
+
+        async def list_goals(i: int):
+            return await client.get("/api/v1/goals", headers=headers(i))
+
+        async def daily_todos(i: int):
+            return await client.get("/api/v1/todos/", headers=headers(i))
+
+        todo_ids: List[tuple] = []
+
+        async def toggle_todo(i: int):
+            todo_id, token_index = todo_ids[i % len(todo_ids)]
+            return await client.put(
+                f"/api/v1/todos/{todo_id}",
+                headers=headers(token_index),
+                json={"completed": rng.random() < 0.5},
+            )
+
+        calls = {
+            "register": register,
+            "login": login,
+            "create-goal": create_goal,
+            "list-goals": list_goals,
+            "daily-todos": daily_todos,
+            "toggle-todo": toggle_todo,
+        }
+
+        # Every phase after login needs tokens, and toggling needs todos
+        if "login" not in phases:
+            await run_phase("login", len(emails), args.concurrency, login)
+        for name in PHASES:
+            if name not in phases:
+                continue
+            if name == "toggle-todo":
+                for index in range(len(tokens)):
+                    response = await daily_todos(index)
+                    todo_ids += [(todo["_id"], index) for todo in response.json()]
+                if not todo_ids:
+                    continue
+            results.append(await run_phase(name, args.requests, args.concurrency, calls[name]))
+
+    database.close()
+
+    print(f"{'endpoint':<14}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        print(
+            f"{result['endpoint']:<14}{result['requests']:>9}{result['errors']:>8}{result['throughput']:>10.1f}"
+            f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {result["endpoint"]: result for result in json.load(f)}
+        regressions = [
+            result["endpoint"]
+            for result in results
+            if result["endpoint"] in baseline
+            and result["p95_ms"] > baseline[result["endpoint"]]["p95_ms"] * (1 + args.max_regression)
+        ]
+        if regressions:
+            print(f"p95 regressed by more than {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""
+Seeds a database with users, goals, habits and todo history for benchmarks.
+
+    MONGO_URL=mongodb://localhost:27017 MONGO_DB_NAME=habit_builder_bench \\
+        python -m benchmarks.seed --users 200 --goals 5 --habits 4 --days 365
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = "benchmark-password"
+CATEGORIES = ["Health", "Wellness", "Work", "Financial", "Family", "Pets", "Other"]
+INSERT_CHUNK = 10000
+
+
+async def _insert(collection, documents: List[Dict]):
+    for i in range(0, len(documents), INSERT_CHUNK):
+        await collection.insert_many(documents[i:i + INSERT_CHUNK], ordered=False)
+
+
+async def seed(db, users: int, goals_per_user: int, habits_per_goal: int, days: int, completion_rate: float = 0.7, seed_value: int = 42) -> List[str]:
+    """
+    Inserts the data set and returns the emails of the seeded users, who all
+    share PASSWORD.
+    """
+    from app.password_service import get_pwd_context
+
+    rng = random.Random(seed_value)
+    hashed_password = get_pwd_context().hash(PASSWORD)
+    today = date.today()
+    run_id = ObjectId()
+
+    user_docs, goal_docs, habit_docs, todo_docs = [], [], [], []
+    for u in range(users):
+        user_id = ObjectId()
+        user_docs.append({
+            "_id": user_id,
+            "email": f"bench_{run_id}_{u}@example.com",
+            "hashed_password": hashed_password,
+            "createdAt": datetime.utcnow(),
+        })
+        for g in range(goals_per_user):
+            goal_id = ObjectId()
+            goal_docs.append({
+                "_id": goal_id,
+                "description": f"Benchmark goal {g} of user {u}",
+                "user_id": user_id,
+                "completion_date": None,
+                "category": rng.choice(CATEGORIES),
+            })
+            for h in range(habits_per_goal):
+                habit_id = ObjectId()
+                frequency = "daily" if h % 4 else "weekly"
+                habit_docs.append({
+                    "_id": habit_id,
+                    "description": f"Benchmark habit {h}",
+                    "frequency": frequency,
+                    "goal_id": goal_id,
+                })
+                if frequency != "daily":
+                    continue
+                # History up to yesterday; today's todos are left to the API
+                for d in range(days, 0, -1):
+                    day = today - timedelta(days=d)
+                    todo_docs.append({
+                        "description": f"Benchmark habit {h}",
+                        "completed": rng.random() < completion_rate,
+                        "due_date": datetime(day.year, day.month, day.day),
+                        "user_id": user_id,
+                        "habit_id": habit_id,
+                    })
+
+    await _insert(db.users, user_docs)
+    await _insert(db.goals, goal_docs)
+    await _insert(db.habits, habit_docs)
+    await _insert(db.todos, todo_docs)
+    print(f"Seeded {len(user_docs)} users, {len(goal_docs)} goals, {len(habit_docs)} habits, {len(todo_docs)} todos")
+    return [user["email"] for user in user_docs]
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--goals", type=int, default=5, help="goals per user")
+    parser.add_argument("--habits", type=int, default=4, help="habits per goal, every fourth is weekly")
+    parser.add_argument("--days", type=int, default=90, help="days of todo history per daily habit")
+    parser.add_argument("--completion-rate", type=float, default=0.7)
+
+
+async def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    from app import database
+    from app.indexes import ensure_indexes
+
+    db = database.connect()
+    await ensure_indexes(db)
+    await seed(db, args.users, args.goals, args.habits, args.days, args.completion_rate)
+    database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
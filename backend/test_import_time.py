@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+# Seconds a fresh interpreter may take to import the app
+IMPORT_TIME_BUDGET_SECONDS = float(os.getenv("IMPORT_TIME_BUDGET_SECONDS", "1.5"))
+
+CHECK = """
+import sys, time
+started = time.perf_counter()
+import app.main
+print(time.perf_counter() - started)
+print(",".join(name for name in ("openai", "passlib") if name in sys.modules))
+"""
+
+def test_import_time():
+    # No API key or Mongo settings: importing the app must not need them
+    env = {key: value for key, value in os.environ.items() if not key.startswith(("OPENAI_", "MONGO_"))}
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    elapsed, loaded = result.stdout.split("\n")[:2]
+    assert loaded == "", f"imported eagerly: {loaded}"
+    assert float(elapsed) < IMPORT_TIME_BUDGET_SECONDS, f"importing the app took {float(elapsed):.2f}s"